@@ -91,5 +91,56 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Visualizer settings
+# Maximum size of an upload after decompression (guards against zip bombs)
+VISUALIZER_MAX_INFLATED_SIZE = 512 * 1024 * 1024
+
+# Output image defaults: format is 'png', 'png8' (palette-quantized) or 'webp'.
+# WebP is picked automatically when the browser's Accept header allows it.
+VISUALIZER_IMAGE_FORMAT = 'png'
+VISUALIZER_DPI = 150
+# zlib level for PNG output (0-9) and WebP encoder effort (0-6)
+VISUALIZER_PNG_COMPRESS_LEVEL = 6
+VISUALIZER_WEBP_METHOD = 4
+
+# Models with at least this many elements are drawn by the Pillow/NumPy raster renderer
+# instead of matplotlib (None to always use matplotlib)
+VISUALIZER_RASTER_THRESHOLD = 20000
+
+# Elements drawn closer than this many pixels are grouped into one marker with a count tag
+# (None to draw and label every element)
+VISUALIZER_LOD_PIXELS = 16
+
+# Route /visualize/ to the async view (for ASGI deployments such as uvicorn)
+VISUALIZER_ASYNC_VIEW = False
+# Worker processes for the async view's parse/placement/render stages (None = CPU count)
+VISUALIZER_RENDER_WORKERS = None
+# Uploads processed at once by the async view; others wait up to VISUALIZER_QUEUE_TIMEOUT
+# seconds before being rejected with 503 and a Retry-After header
+VISUALIZER_MAX_CONCURRENT_RENDERS = 4
+VISUALIZER_QUEUE_TIMEOUT = 2
+VISUALIZER_RETRY_AFTER = 10
+
+# Show a quick low-DPI preview first and swap in the full-resolution image when ready.
+# Full renders are written to MEDIA_ROOT/results/ and removed after VISUALIZER_RESULT_TTL seconds.
+VISUALIZER_PROGRESSIVE_RENDER = True
+VISUALIZER_PREVIEW_DPI = 50
+VISUALIZER_RESULT_TTL = 24 * 60 * 60
+
+# Memory budget shared by the renders started from one server process. The budget is not
+# shared between processes: with N server worker processes (e.g. gunicorn --workers N) the
+# renders can use up to N x VISUALIZER_MEMORY_BUDGET, so set it to the memory available for
+# rendering divided by the number of worker processes. Uploads whose
+# estimated peak usage does not fit are rendered at a lower DPI (down to VISUALIZER_MIN_DPI),
+# then with tags for only part of the elements (at least VISUALIZER_MIN_LABELS), or rejected.
+# Uploads that fit but have to wait for memory are queued for VISUALIZER_MEMORY_QUEUE_TIMEOUT
+# seconds before getting a 503 response.
+VISUALIZER_MEMORY_BUDGET = 2 * 1024 * 1024 * 1024
+VISUALIZER_MEMORY_QUEUE_TIMEOUT = 30
+VISUALIZER_MIN_DPI = 72
+VISUALIZER_MIN_LABELS = 500
+# Measure every pipeline stage with tracemalloc (slow; RSS is always sampled)
+VISUALIZER_TRACK_MEMORY = False
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
\ No newline at end of file
@@ -0,0 +1,94 @@
+# visualizer/export.py
+import csv
+import json
+
+from .pipeline import run_placement
+
+# Placement export formats mapped to their MIME types
+PLACEMENT_FORMATS = {
+    'jsonl': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+# Columns of an exported placement, one row per tag
+PLACEMENT_FIELDS = (
+    'element_id', 'family', 'text',
+    'x', 'y', 'width', 'height',
+    'line_start_x', 'line_start_y', 'line_end_x', 'line_end_y',
+)
+
+
+def placement_row(tag):
+    """
+    Returns the geometry of a tag as a dict with the PLACEMENT_FIELDS
+
+    The tag box spans (x, y) to (x + width, y + height) in element coordinates and
+    its leader line runs from the element to the center of the box.
+    """
+    return {
+        'element_id': tag.element.id,
+        'family': tag.element.family_name or '',
+        'text': tag.text,
+        'x': tag.x,
+        'y': tag.y,
+        'width': tag.width,
+        'height': tag.height,
+        'line_start_x': tag.line_start_x,
+        'line_start_y': tag.line_start_y,
+        'line_end_x': tag.x + tag.width / 2,
+        'line_end_y': tag.y + tag.height / 2,
+    }
+
+
+class _LineBuffer:
+    """File-like object handing back what csv.writer writes, one row at a time"""
+
+    def write(self, value):
+        return value
+
+
+def iter_placement_lines(tags, output_format='jsonl'):
+    """
+    Yield the placement of each tag as a line of text
+
+    Args:
+        tags: List of placed Tag objects
+        output_format: 'jsonl' for one JSON object per line, 'csv' for a header and one row per tag
+
+    Yields:
+        Lines ending in a newline
+    """
+    if output_format == 'jsonl':
+        for tag in tags:
+            yield json.dumps(placement_row(tag)) + '\n'
+    elif output_format == 'csv':
+        writer = csv.DictWriter(_LineBuffer(), fieldnames=PLACEMENT_FIELDS, lineterminator='\n')
+        yield writer.writeheader()
+        for tag in tags:
+            yield writer.writerow(placement_row(tag))
+    else:
+        raise ValueError(f'Unknown placement format "{output_format}", expected one of {sorted(PLACEMENT_FORMATS)}')
+
+
+def export_placements(upload, output_format='jsonl', **kwargs):
+    """
+    Parse an upload, place its tags and return their geometry without rendering
+
+    Parsing and placement happen before this returns, so errors are raised here
+    rather than while the lines are consumed.
+
+    Args:
+        upload: Binary file-like object with the (possibly compressed) JSON data
+        output_format: One of PLACEMENT_FORMATS
+        **kwargs: Passed through to run_placement (upload_name, families, tag_size, ...)
+
+    Returns:
+        Iterator over the lines of the export
+
+    Raises:
+        VisualizationError: If the upload cannot be parsed or has no elements to label
+    """
+    if output_format not in PLACEMENT_FORMATS:
+        raise ValueError(f'Unknown placement format "{output_format}", expected one of {sorted(PLACEMENT_FORMATS)}')
+    tags = run_placement(upload, **kwargs)
+    return iter_placement_lines(tags, output_format)
@@ -0,0 +1,153 @@
+# visualizer/families.py
+import fnmatch
+import operator
+import re
+from itertools import chain
+
+# Families labeled when no rules are given
+DEFAULT_LABEL_RULES = ('*KIT(DS)1*',)
+
+# Rules starting with this prefix are regular expressions, all others are glob patterns
+REGEX_PREFIX = 're:'
+
+# Roles a family can have in a visualization
+LABEL = 'label'
+GRAY = 'gray'
+HIDE = 'hide'
+
+
+class FamilyRuleError(ValueError):
+    """Raised when a family rule is not a valid pattern"""
+
+
+def split_rules(text):
+    """Returns the non-empty rules of a newline-separated string"""
+    return [line.strip() for line in (text or '').splitlines() if line.strip()]
+
+
+class FamilyRules:
+    """
+    Set of family name rules, compiled once
+
+    Glob rules (e.g. 'KIT*') must match the whole family name, regular expression
+    rules (e.g. 're:^Door|Window') match anywhere in it.
+    """
+
+    def __init__(self, rules=()):
+        self.rules = tuple(rule.strip() for rule in rules if rule.strip())
+        self._matchers = [self._compile(rule) for rule in self.rules]
+
+    @staticmethod
+    def _compile(rule):
+        if rule.startswith(REGEX_PREFIX):
+            try:
+                return re.compile(rule[len(REGEX_PREFIX):]).search
+            except re.error as e:
+                raise FamilyRuleError(f'Invalid family pattern "{rule}": {e}')
+        return re.compile(fnmatch.translate(rule)).match
+
+    def matches(self, family_name):
+        """Whether any rule matches a family name"""
+        name = family_name or ''
+        return any(match(name) for match in self._matchers)
+
+    def __bool__(self):
+        return bool(self.rules)
+
+
+class FamilySelection:
+    """Which families are labeled, drawn in gray or hidden"""
+
+    def __init__(self, label=(), gray=(), hide=()):
+        """
+        Args:
+            label: Rules for families whose elements get tags, DEFAULT_LABEL_RULES if empty
+            gray: Rules for families drawn in gray without tags
+            hide: Rules for families left out, even if matched by label or gray
+        """
+        self.label = FamilyRules(label or DEFAULT_LABEL_RULES)
+        self.gray = FamilyRules(gray)
+        self.hide = FamilyRules(hide)
+
+    @classmethod
+    def default(cls, show_other_families=False):
+        """KIT(DS)1 elements labeled, optionally with all other families in gray"""
+        return cls(gray=['*'] if show_other_families else ())
+
+    def role(self, family_name):
+        """Returns LABEL, GRAY or HIDE for a family name"""
+        if self.hide.matches(family_name):
+            return HIDE
+        if self.label.matches(family_name):
+            return LABEL
+        if self.gray.matches(family_name):
+            return GRAY
+        return HIDE
+
+
+def _take(elements, indices):
+    """Returns the elements at the given indices as a list"""
+    if not indices:
+        return []
+    if len(indices) == 1:
+        return [elements[indices[0]]]
+    return list(operator.itemgetter(*indices)(elements))
+
+
+class FamilyIndex:
+    """Mapping of family names to the (ascending) indices of their elements"""
+
+    def __init__(self, elements):
+        self.elements = elements
+        self.indices = {}
+        # Role of each family and the labeled elements under the selection last passed to split()
+        self.roles = {}
+        self._labeled = []
+
+        # Family names are interned at parse time, so this only hashes a few distinct strings
+        for i, element in enumerate(elements):
+            family_indices = self.indices.get(element.family_name)
+            if family_indices is None:
+                family_indices = self.indices[element.family_name] = []
+            family_indices.append(i)
+
+    def __len__(self):
+        return len(self.elements)
+
+    def count(self, family_name):
+        """Returns the number of elements of a family"""
+        return len(self.indices.get(family_name, ()))
+
+    def select(self, family_names):
+        """Returns the elements of the given families in their original order"""
+        index_lists = [self.indices[name] for name in family_names if name in self.indices]
+        if len(index_lists) == 1:
+            return _take(self.elements, index_lists[0])
+        # Each list is already sorted, which timsort merges in linear time
+        return _take(self.elements, sorted(chain.from_iterable(index_lists)))
+
+    def split(self, selection):
+        """
+        Split the elements by their family's role
+
+        Returns:
+            Tuple of (elements to label, elements to draw in gray)
+        """
+        # Rules are matched once per family, not once per element
+        self.roles = {name: selection.role(name) for name in self.indices}
+        labeled = self.select([name for name, role in self.roles.items() if role == LABEL])
+        gray = self.select([name for name, role in self.roles.items() if role == GRAY])
+
+        for element in self._labeled:
+            element.is_labeled = False
+        for element in labeled:
+            element.is_labeled = True
+        self._labeled = labeled
+        return labeled, gray
+
+    def summary(self):
+        """Returns name, element count and role of every family, largest first"""
+        return [
+            {'name': name or '(none)', 'count': len(self.indices[name]), 'role': self.roles.get(name, HIDE)}
+            for name in sorted(self.indices, key=lambda name: -len(self.indices[name]))
+        ]
@@ -1,18 +1,92 @@
 # visualizer/forms.py
 from django import forms
 
+from .families import FamilyRuleError, FamilySelection, split_rules
+from .uploads import zstandard
+
+# Family rule fields, one glob pattern (or re:<regular expression>) per line
+FAMILY_RULE_FIELDS = ('label_families', 'gray_families', 'hide_families')
 
-class JsonUploadForm(forms.Form):
-    json_file = forms.FileField(
-        label='Select a JSON file',
-        help_text='JSON file with element coordinates.',
-        widget=forms.FileInput(attrs={'accept': '.json'})
-    )
 
+class VisualizationOptionsForm(forms.Form):
     # Optional setting for visualization
     show_other_families = forms.BooleanField(
         required=False,
         initial=False,
         label='Show other element families (in gray)',
         help_text='Displays elements from families other than KIT(DS)1'
-    )
\ No newline at end of file
+    )
+
+    # Optional family rules, one glob pattern or re:<regular expression> per line
+    label_families = forms.CharField(
+        required=False,
+        widget=forms.Textarea(attrs={'rows': 2, 'placeholder': '*KIT(DS)1*'}),
+        label='Families to label',
+        help_text='One pattern per line, e.g. KIT* or re:^Door. Defaults to KIT(DS)1.'
+    )
+
+    gray_families = forms.CharField(
+        required=False,
+        widget=forms.Textarea(attrs={'rows': 2}),
+        label='Families to show in gray',
+        help_text='Overrides "Show other element families" when set'
+    )
+
+    hide_families = forms.CharField(
+        required=False,
+        widget=forms.Textarea(attrs={'rows': 2}),
+        label='Families to hide',
+        help_text='Takes precedence over the rules above'
+    )
+
+    # Optional output settings, defaults come from the VISUALIZER_* settings
+    image_format = forms.ChoiceField(
+        required=False,
+        choices=[
+            ('', 'Automatic'),
+            ('png', 'PNG'),
+            ('png8', 'PNG (256 colors, smaller)'),
+            ('webp', 'WebP (lossless, smallest)'),
+        ],
+        label='Image format',
+        help_text='Automatic picks WebP when your browser supports it'
+    )
+
+    dpi = forms.IntegerField(
+        required=False,
+        min_value=50,
+        max_value=300,
+        label='Resolution (DPI)',
+        help_text='Leave empty for the default resolution'
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+
+        # Compile the family rules once for the whole request
+        gray_rules = split_rules(cleaned_data.get('gray_families'))
+        if not gray_rules and cleaned_data.get('show_other_families'):
+            gray_rules = ['*']
+        try:
+            cleaned_data['families'] = FamilySelection(
+                label=split_rules(cleaned_data.get('label_families')),
+                gray=gray_rules,
+                hide=split_rules(cleaned_data.get('hide_families')),
+            )
+        except FamilyRuleError as e:
+            raise forms.ValidationError(str(e))
+        return cleaned_data
+
+
+class JsonUploadForm(VisualizationOptionsForm):
+    json_file = forms.FileField(
+        label='Select a JSON file',
+        help_text='JSON file with element coordinates (optionally compressed as .json.gz or .json.zst).',
+        widget=forms.FileInput(attrs={'accept': '.json,.gz,.zst'})
+    )
+
+    def clean_json_file(self):
+        json_file = self.cleaned_data['json_file']
+        if json_file.name.lower().endswith('.zst') and zstandard is None:
+            raise forms.ValidationError('Zstandard-compressed uploads are not supported on this server.')
+        return json_file
@@ -0,0 +1,157 @@
+# visualizer/jobs.py
+import functools
+import json
+import multiprocessing
+import os
+import shutil
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+from .pipeline import STATUS_FILE, render_to_directory, write_status
+from .uploads import detect_compression
+
+# Subdirectory of MEDIA_ROOT holding one directory per render job
+RESULTS_DIR = 'results'
+
+# File names used when storing an upload, by compression
+UPLOAD_FILES = {
+    'gzip': 'upload.json.gz',
+    'zstd': 'upload.json.zst',
+    None: 'upload.json',
+}
+
+# Error reported when a render worker process died, e.g. killed for running out of memory
+WORKER_FAILED_ERROR = 'The render worker stopped unexpectedly, the file may be too large to render.'
+
+# Lazily created process pool for CPU-bound pipeline stages
+_render_executor = None
+
+
+def get_render_executor():
+    """Returns the process pool used for CPU-bound pipeline stages"""
+    global _render_executor
+    if _render_executor is None:
+        # Spawn instead of fork, as the web server process may be multi-threaded
+        _render_executor = ProcessPoolExecutor(
+            max_workers=settings.VISUALIZER_RENDER_WORKERS or os.cpu_count(),
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _render_executor
+
+
+def discard_render_executor(executor):
+    """
+    Forget a broken process pool, so the next render starts a new one
+
+    A pool whose worker died raises BrokenProcessPool for all further work.
+    """
+    global _render_executor
+    if _render_executor is executor:
+        _render_executor = None
+
+
+def get_result_dir(job_id):
+    """Returns the directory holding the files of a render job"""
+    return os.path.join(settings.MEDIA_ROOT, RESULTS_DIR, job_id)
+
+
+def get_result_url(job_id, filename):
+    """Returns the media URL of a file in a render job's directory"""
+    return f'{settings.MEDIA_URL}{RESULTS_DIR}/{job_id}/{filename}'
+
+
+def _remove_expired_results():
+    """Delete result directories older than VISUALIZER_RESULT_TTL seconds"""
+    results_root = os.path.join(settings.MEDIA_ROOT, RESULTS_DIR)
+    if not os.path.isdir(results_root):
+        return
+
+    cutoff = time.time() - settings.VISUALIZER_RESULT_TTL
+    for entry in os.scandir(results_root):
+        if entry.is_dir() and entry.stat().st_mtime < cutoff:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def create_result_dir():
+    """
+    Create the directory for a new render job
+
+    Returns:
+        Tuple of (job id, directory path)
+    """
+    _remove_expired_results()
+
+    job_id = str(uuid.uuid4())
+    result_dir = get_result_dir(job_id)
+    os.makedirs(result_dir)
+    return job_id, result_dir
+
+
+def discard_result(job_id):
+    """Delete a render job's directory"""
+    shutil.rmtree(get_result_dir(job_id), ignore_errors=True)
+
+
+def save_upload(result_dir, upload, upload_name=None, content_encoding=None):
+    """
+    Copy the (still compressed) upload into a result directory
+
+    Returns:
+        The stored file name, whose suffix records the compression
+    """
+    upload_file = UPLOAD_FILES[detect_compression(upload, upload_name, content_encoding)]
+
+    with open(os.path.join(result_dir, upload_file), 'wb') as f:
+        if hasattr(upload, 'chunks'):
+            for chunk in upload.chunks():
+                f.write(chunk)
+        else:
+            shutil.copyfileobj(upload, f)
+
+    return upload_file
+
+
+def _record_failed_render(result_dir, executor, future):
+    """
+    Done callback writing an error status when the render worker itself failed
+
+    render_to_directory records its own errors, so an exception here means the worker
+    process died (e.g. killed for running out of memory) before it could.
+    """
+    if future.cancelled():
+        error = 'The render was cancelled.'
+    elif future.exception() is not None:
+        error = WORKER_FAILED_ERROR
+        if isinstance(future.exception(), BrokenProcessPool):
+            discard_render_executor(executor)
+    else:
+        return
+    write_status(result_dir, {'status': 'error', 'error': error})
+
+
+def submit_full_render(result_dir, upload_name, **options):
+    """
+    Start rendering the full-resolution image of a stored upload in the background
+
+    Returns:
+        A concurrent.futures.Future that completes when status.json has been written
+    """
+    executor = get_render_executor()
+    future = executor.submit(
+        functools.partial(render_to_directory, result_dir, upload_name, **options)
+    )
+    future.add_done_callback(functools.partial(_record_failed_render, result_dir, executor))
+    return future
+
+
+def read_status(job_id):
+    """Returns the status dict of a render job, or None while it is still running"""
+    try:
+        with open(os.path.join(get_result_dir(job_id), STATUS_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,102 @@
+# visualizer/lod.py
+from itertools import count
+
+import numpy as np
+
+from .utils import ElementGroup, compute_view_layout
+
+# Elements drawn smaller than this many pixels are grouped with their close neighbors;
+# about the height of a tag at the minimum font size, so groups rarely need more room than a tag
+LOD_PIXEL_THRESHOLD = 16
+
+
+def pixels_per_unit(elements, dpi=150):
+    """Approximate scale of the rendered image, before tags widen the view"""
+    (min_x, max_x, min_y, max_y), (fig_width, fig_height) = compute_view_layout(elements)
+    return min(fig_width * dpi / (max_x - min_x), fig_height * dpi / (max_y - min_y))
+
+
+def cluster_elements(elements, cell_size, group_ids):
+    """
+    Replace dense clusters of small elements by ElementGroups with a grid hash
+
+    Elements smaller than cell_size are hashed into square cells of that size by their
+    center. Cells holding more than one of them become a group, placed where the first
+    of its members was, so the order of elements (and max_labels) is kept.
+
+    Args:
+        elements: List of Element objects
+        cell_size: Cell size in data units
+        group_ids: Iterator of ids for new groups
+
+    Returns:
+        List of elements and ElementGroups
+    """
+    if len(elements) < 2:
+        return elements
+
+    bounds = np.array([(e.min_x, e.min_y, e.max_x, e.max_y) for e in elements], dtype=float)
+    sizes = np.maximum(bounds[:, 2] - bounds[:, 0], bounds[:, 3] - bounds[:, 1])
+    small = np.flatnonzero(sizes < cell_size)
+    if len(small) < 2:
+        return elements
+
+    centers = (bounds[small, :2] + bounds[small, 2:]) / 2
+    cells = np.floor(centers / cell_size).astype(np.int64)
+    _, cell_of, cell_sizes = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+    cell_of = cell_of.ravel()
+    grouped = cell_sizes[cell_of] > 1
+    if not grouped.any():
+        return elements
+
+    # Members of each cell in ascending element order
+    grouped_indices, grouped_cells = small[grouped], cell_of[grouped]
+    order = np.argsort(grouped_cells, kind='stable')
+    splits = np.flatnonzero(np.diff(grouped_cells[order])) + 1
+    groups = {}
+    for members in np.split(grouped_indices[order], splits):
+        members = members.tolist()
+        groups[members[0]] = ElementGroup(f'group-{next(group_ids)}', [elements[i] for i in members])
+
+    skipped = set(grouped_indices.tolist())
+    result = []
+    for i, element in enumerate(elements):
+        if i in groups:
+            result.append(groups[i])
+        elif i not in skipped:
+            result.append(element)
+    return result
+
+
+def apply_level_of_detail(kit_elements, other_elements, dpi=150, pixel_threshold=LOD_PIXEL_THRESHOLD):
+    """
+    Group elements that would be drawn within a few pixels of each other
+
+    Labeled and gray elements are grouped separately, so each group of labeled
+    elements gets a single tag with its element count. Tag placement and rendering
+    then scale with what is visible at the given DPI rather than the element count.
+
+    Args:
+        kit_elements: List of Element objects to label
+        other_elements: List of other Element objects
+        dpi: Resolution of the image
+        pixel_threshold: Grid cell size in pixels, no grouping if None or 0
+
+    Returns:
+        Tuple of (elements to label, other elements), with ElementGroups in place of clusters
+    """
+    if not pixel_threshold:
+        return kit_elements, other_elements
+
+    cell_size = pixel_threshold / pixels_per_unit(kit_elements + other_elements, dpi)
+    group_ids = count(1)
+    return (
+        cluster_elements(kit_elements, cell_size, group_ids),
+        cluster_elements(other_elements, cell_size, group_ids),
+    )
+
+
+def count_grouped(elements):
+    """Returns (number of groups, number of elements they stand for)"""
+    groups = [element for element in elements if isinstance(element, ElementGroup)]
+    return len(groups), sum(len(group.members) for group in groups)
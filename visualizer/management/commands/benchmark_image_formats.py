@@ -0,0 +1,60 @@
+# visualizer/management/commands/benchmark_image_formats.py
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from visualizer.pipeline import VisualizationError, load_elements
+from visualizer.utils import build_figure, encode_canvas, place_tags_grid_snapping
+
+
+class Command(BaseCommand):
+    help = 'Measure encode time and byte size of each output image format for a JSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('json_file', help='JSON file (optionally .json.gz/.json.zst) with elements')
+        parser.add_argument('--dpi', type=int, nargs='+', default=[150], help='Resolutions to benchmark')
+        parser.add_argument('--compress-levels', type=int, nargs='+', default=[1, 6, 9],
+                            help='zlib levels to benchmark for PNG output')
+        parser.add_argument('--webp-methods', type=int, nargs='+', default=[0, 4, 6],
+                            help='WebP encoder efforts to benchmark')
+        parser.add_argument('--repeat', type=int, default=3, help='Encodes per variant (best time is reported)')
+        parser.add_argument('--show-other-families', action='store_true')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['json_file'], 'rb') as upload:
+                index, kit_elements, other_elements = load_elements(
+                    upload, options['json_file'], show_other_families=options['show_other_families']
+                )
+        except VisualizationError as e:
+            raise CommandError(str(e))
+
+        tags = place_tags_grid_snapping(kit_elements, other_elements, 12)
+
+        variants = [('png', {'compress_level': level}) for level in options['compress_levels']]
+        variants += [('png8', {'compress_level': level}) for level in options['compress_levels']]
+        variants += [('webp', {'webp_method': method}) for method in options['webp_methods']]
+
+        self.stdout.write(f'{len(index)} elements, {len(tags)} tags')
+        self.stdout.write(f'{"dpi":>5} {"format":<8} {"setting":<18} {"encode ms":>10} {"bytes":>12}')
+
+        for dpi in options['dpi']:
+            canvas = build_figure(kit_elements, tags, other_elements, dpi=dpi).canvas
+
+            start = time.perf_counter()
+            canvas.draw()
+            draw_ms = (time.perf_counter() - start) * 1000
+            width, height = canvas.get_width_height()
+            self.stdout.write(f'{dpi:>5} {"(draw)":<8} {f"{width}x{height} px":<18} {draw_ms:>10.1f}')
+
+            for image_format, encoder_options in variants:
+                best_ms = float('inf')
+                for _ in range(options['repeat']):
+                    start = time.perf_counter()
+                    image_bytes = encode_canvas(canvas, image_format, **encoder_options)
+                    best_ms = min(best_ms, (time.perf_counter() - start) * 1000)
+
+                setting = ', '.join(f'{key}={value}' for key, value in encoder_options.items())
+                self.stdout.write(
+                    f'{dpi:>5} {image_format:<8} {setting:<18} {best_ms:>10.1f} {len(image_bytes):>12,}'
+                )
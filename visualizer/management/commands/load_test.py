@@ -0,0 +1,345 @@
+# visualizer/management/commands/load_test.py
+import gzip
+import json
+import math
+import os
+import random
+import re
+import shlex
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from visualizer.memory import process_rss
+
+# Families of the synthetic elements with their share of all elements
+SYNTHETIC_FAMILIES = (('KIT(DS)1_Socket', 0.6), ('Door_Single', 0.25), ('Window_Fixed', 0.15))
+
+# Link to the progressive render status in the result page
+STATUS_URL_RE = re.compile(r'data-status-url="([^"]+)"')
+
+PERCENTILES = (50, 95, 99)
+
+# Most rows printed for the RSS timeline
+MAX_TIMELINE_ROWS = 20
+
+
+def synthetic_elements(count, seed=0):
+    """
+    Returns elements in the upload JSON format, spread at a constant density so
+    tag placement does comparable work per element for every size
+    """
+    rng = random.Random(seed)
+    names, weights = zip(*SYNTHETIC_FAMILIES)
+    side = 4 * math.sqrt(count)
+
+    elements = []
+    for i in range(count):
+        x, y = rng.uniform(0, side * 2), rng.uniform(0, side)
+        elements.append({
+            'id': 100000 + i,
+            'document': 'Synthetic load test model',
+            'coordinates': {
+                'family_name': rng.choices(names, weights)[0],
+                'min': {'x': x - 0.2, 'y': y - 0.2, 'z': 0},
+                'center': {'x': x, 'y': y, 'z': 0},
+                'max': {'x': x + 0.2, 'y': y + 0.2, 'z': 0},
+            },
+        })
+    return elements
+
+
+def _percentile(sorted_values, percent):
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(percent / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _process_tree(pid):
+    """Returns a process and all its descendants (Linux only)"""
+    pids = [pid]
+    for parent in pids:
+        try:
+            for task in os.listdir(f'/proc/{parent}/task'):
+                with open(f'/proc/{parent}/task/{task}/children') as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+class RssSampler(threading.Thread):
+    """Records the total RSS of a server process and its workers at a fixed interval"""
+
+    def __init__(self, pid, interval):
+        super().__init__(name='load-test-rss-sampler', daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []  # (seconds since start, number of processes, RSS in bytes)
+        self._stopped = threading.Event()
+
+    def run(self):
+        start = time.perf_counter()
+        while True:
+            rss = [process_rss(pid) for pid in _process_tree(self.pid)]
+            rss = [value for value in rss if value is not None]
+            if rss:
+                self.samples.append((time.perf_counter() - start, len(rss), sum(rss)))
+            if self._stopped.wait(self.interval):
+                return
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+class Command(BaseCommand):
+    help = 'POST synthetic JSON files to a local server and report throughput, latency and memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='Base URL of a running server (default: start one on a free port)')
+        parser.add_argument('--server-command',
+                            help='Command starting the server, "{port}" is replaced by the port '
+                                 '(default: manage.py runserver --noreload)')
+        parser.add_argument('--server-log', help='File for the output of the started server')
+        parser.add_argument('--server-pid', type=int, help='Process to sample RSS of when using --url')
+        parser.add_argument('-c', '--concurrency', type=int, default=8, help='Concurrent clients')
+        parser.add_argument('--rate', type=float, default=0,
+                            help='Requests started per second (default: as fast as the clients allow); '
+                                 'latency is then measured from the scheduled start')
+        parser.add_argument('-n', '--requests', type=int, default=100, help='Total number of requests')
+        parser.add_argument('--duration', type=float, help='Stop starting requests after this many seconds')
+        parser.add_argument('--sizes', type=int, nargs='+', default=[25, 100, 250],
+                            help='Element counts of the synthetic files, picked at random per request')
+        parser.add_argument('--gzip', action='store_true', help='Send bodies with Content-Encoding: gzip')
+        parser.add_argument('--wait-full', action='store_true',
+                            help='With progressive rendering, also wait for the full render of each request')
+        parser.add_argument('--sample-interval', type=float, default=1.0, help='Seconds between RSS samples')
+        parser.add_argument('--startup-timeout', type=float, default=60)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json-output', help='Also write per-request results and RSS samples to this file')
+
+    def handle(self, *args, **options):
+        payloads = {}
+        for size in options['sizes']:
+            body = json.dumps(synthetic_elements(size, options['seed'])).encode('utf-8')
+            payloads[size] = gzip.compress(body) if options['gzip'] else body
+
+        server = None
+        base_url = options['url']
+        server_pid = options['server_pid']
+        if base_url is None:
+            server, base_url = self._start_server(options)
+            server_pid = server.pid
+
+        sampler = RssSampler(server_pid, options['sample_interval']) if server_pid else None
+        try:
+            if sampler:
+                sampler.start()
+            results, elapsed = self._run_load(base_url.rstrip('/'), payloads, options)
+        finally:
+            if sampler:
+                sampler.stop()
+            if server:
+                server.terminate()
+                try:
+                    server.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    server.kill()
+
+        rss_samples = sampler.samples if sampler else []
+        self._report(results, elapsed, rss_samples, options)
+
+        if options['json_output']:
+            with open(options['json_output'], 'w') as f:
+                json.dump({
+                    'options': {key: options[key] for key in (
+                        'concurrency', 'rate', 'requests', 'duration', 'sizes', 'gzip', 'wait_full'
+                    )},
+                    'elapsed': elapsed,
+                    'requests': results,
+                    'rss': [{'seconds': t, 'processes': n, 'rss_bytes': rss} for t, n, rss in rss_samples],
+                }, f, indent=2)
+
+    def _start_server(self, options):
+        """Start the server on a free port and wait until it answers"""
+        port = _free_port()
+        command = options['server_command'] or (
+            f'{shlex.quote(sys.executable)} manage.py runserver 127.0.0.1:{{port}} --noreload'
+        )
+        log = open(options['server_log'], 'ab') if options['server_log'] else subprocess.DEVNULL
+        server = subprocess.Popen(
+            shlex.split(command.format(port=port)), cwd=settings.BASE_DIR,
+            stdout=log, stderr=subprocess.STDOUT
+        )
+        base_url = f'http://127.0.0.1:{port}'
+
+        deadline = time.monotonic() + options['startup_timeout']
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f'The server exited with code {server.returncode}.')
+            try:
+                urllib.request.urlopen(base_url + '/', timeout=2).close()
+                self.stdout.write(f'Server started at {base_url} (pid {server.pid})')
+                return server, base_url
+            except OSError:
+                time.sleep(0.2)
+
+        server.kill()
+        raise CommandError(f'The server did not answer within {options["startup_timeout"]}s.')
+
+    def _run_load(self, base_url, payloads, options):
+        """
+        Send the requests from a pool of client threads
+
+        Returns:
+            Tuple of (list of result dicts, elapsed seconds)
+        """
+        rng = random.Random(options['seed'])
+        sizes = [rng.choice(options['sizes']) for _ in range(options['requests'])]
+        headers = {'Content-Type': 'application/json'}
+        if options['gzip']:
+            headers['Content-Encoding'] = 'gzip'
+
+        lock = threading.Lock()
+        next_request = iter(range(len(sizes)))
+        results = []
+        start = time.perf_counter()
+
+        def client():
+            while True:
+                with lock:
+                    i = next(next_request, None)
+                if i is None:
+                    return
+
+                if options['rate']:
+                    # Open loop: requests start on schedule, however slow the server is
+                    scheduled = start + i / options['rate']
+                    time.sleep(max(0.0, scheduled - time.perf_counter()))
+                else:
+                    scheduled = time.perf_counter()
+                if options['duration'] and scheduled - start > options['duration']:
+                    return
+
+                result = self._send(base_url, payloads[sizes[i]], headers, options['wait_full'])
+                result.update({'size': sizes[i], 'start': scheduled - start})
+                # Turn the completion timestamps into latencies
+                for key in ('latency', 'full_latency'):
+                    if key in result:
+                        result[key] -= scheduled
+                with lock:
+                    results.append(result)
+                    done = len(results)
+                if done % max(1, len(sizes) // 10) == 0:
+                    self.stdout.write(f'{done}/{len(sizes)} requests done')
+
+        with ThreadPoolExecutor(max_workers=max(1, options['concurrency'])) as executor:
+            for _ in range(max(1, options['concurrency'])):
+                executor.submit(client)
+
+        return sorted(results, key=lambda result: result['start']), time.perf_counter() - start
+
+    def _send(self, base_url, payload, headers, wait_full):
+        """
+        POST one upload, optionally polling until its full render has finished
+
+        Returns:
+            Dict with the HTTP status, error message and the perf_counter() times at which
+            the response (latency) and the full render (full_latency) were complete
+        """
+        request = urllib.request.Request(base_url + '/visualize/', data=payload, headers=headers, method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=600) as response:
+                status, body = response.status, response.read().decode('utf-8', 'replace')
+        except urllib.error.HTTPError as e:
+            return {'status': e.code, 'error': e.reason}
+        except OSError as e:
+            return {'status': None, 'error': str(e)}
+
+        result = {'status': status, 'error': None, 'latency': time.perf_counter()}
+        status_url = STATUS_URL_RE.search(body)
+        if wait_full and status_url:
+            while True:
+                try:
+                    with urllib.request.urlopen(base_url + status_url.group(1), timeout=30) as response:
+                        render_status = json.load(response)
+                except OSError as e:
+                    result['error'] = f'Status check failed: {e}'
+                    break
+                if render_status['status'] == 'done':
+                    result['full_latency'] = time.perf_counter()
+                    break
+                if render_status['status'] != 'pending':
+                    result['error'] = render_status.get('error') or render_status['status']
+                    break
+                time.sleep(0.1)
+        return result
+
+    def _latency_row(self, label, latencies):
+        latencies = sorted(latencies)
+        values = [_percentile(latencies, p) for p in PERCENTILES] + [latencies[-1] if latencies else None]
+        cells = ''.join(f'{value * 1000:>10.0f}' if value is not None else f'{"-":>10}' for value in values)
+        return f'{label:<22}{cells}'
+
+    def _report(self, results, elapsed, rss_samples, options):
+        total = len(results)
+        if not total:
+            raise CommandError('No requests were sent.')
+
+        ok = [r for r in results if r['status'] == 200 and not r['error']]
+        rejected = sum(1 for r in results if r['status'] == 503)
+        errors = total - len(ok)
+        elements = sum(r['size'] for r in ok)
+
+        self.stdout.write('')
+        self.stdout.write(
+            f'Requests: {total} ({len(ok)} ok, {errors} failed, of which {rejected} rejected with 503), '
+            f'error rate {errors / total:.1%}'
+        )
+        self.stdout.write(
+            f'Throughput: {len(ok) / elapsed:.2f} req/s, {elements / elapsed:,.0f} elements/s over {elapsed:.1f}s '
+            f'(concurrency {options["concurrency"]}, rate {options["rate"] or "unlimited"})'
+        )
+
+        self.stdout.write('')
+        self.stdout.write(f'{"Latency (ms)":<22}' + ''.join(f'{"p" + str(p):>10}' for p in PERCENTILES) + f'{"max":>10}')
+        self.stdout.write(self._latency_row('all', [r['latency'] for r in ok]))
+        for size in sorted(set(options['sizes'])):
+            self.stdout.write(self._latency_row(f'{size} elements', [r['latency'] for r in ok if r['size'] == size]))
+        full_latencies = [r['full_latency'] for r in ok if 'full_latency' in r]
+        if full_latencies:
+            self.stdout.write(self._latency_row('until full render', full_latencies))
+
+        failures = {}
+        for r in results:
+            if r['status'] != 200 or r['error']:
+                key = f"{r['status'] or 'no response'}: {r['error']}"
+                failures[key] = failures.get(key, 0) + 1
+        for key, count in sorted(failures.items(), key=lambda item: -item[1]):
+            self.stderr.write(f'  {count} x {key}')
+
+        if rss_samples:
+            self.stdout.write('')
+            self.stdout.write(f'{"Server RSS":<22}{"seconds":>10}{"processes":>10}{"MB":>10}')
+            step = max(1, math.ceil(len(rss_samples) / MAX_TIMELINE_ROWS))
+            for seconds, processes, rss in rss_samples[::step]:
+                self.stdout.write(f'{"":<22}{seconds:>10.1f}{processes:>10}{rss / 2 ** 20:>10.0f}')
+            peak = max(rss_samples, key=lambda sample: sample[2])
+            self.stdout.write(f'{"peak":<22}{peak[0]:>10.1f}{peak[1]:>10}{peak[2] / 2 ** 20:>10.0f}')
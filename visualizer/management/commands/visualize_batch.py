@@ -0,0 +1,199 @@
+# visualizer/management/commands/visualize_batch.py
+import functools
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from visualizer.families import FamilyRuleError, FamilySelection
+from visualizer.pipeline import image_extension, render_file
+from visualizer.utils import IMAGE_FORMATS
+
+# Input file suffixes, longest first so '.json.gz' wins over '.gz'
+INPUT_SUFFIXES = ('.json.gz', '.json.zst', '.json')
+
+
+def _output_stem(relative_path):
+    """Returns the input path relative to its root, without its JSON/compression suffix"""
+    for suffix in INPUT_SUFFIXES:
+        if relative_path.lower().endswith(suffix):
+            return relative_path[:-len(suffix)]
+    return relative_path
+
+
+def _input_root(pattern):
+    """Returns the directory output names are relative to for a directory, file or glob pattern"""
+    if os.path.isdir(pattern):
+        return pattern
+    root = os.path.dirname(pattern)
+    # The part of a glob pattern before its first wildcard
+    while any(char in root for char in '*?['):
+        root = os.path.dirname(root)
+    return root
+
+
+def _is_up_to_date(input_path, output_paths):
+    """Whether all outputs exist and are newer than the input"""
+    input_mtime = os.path.getmtime(input_path)
+    return all(os.path.exists(path) and os.path.getmtime(path) >= input_mtime for path in output_paths)
+
+
+def _format_memory(stages):
+    """Returns a short description of the memory used by each pipeline stage"""
+    parts = []
+    for name, stage in stages.items():
+        peak = stage.get('traced_peak_mb', stage['peak_rss_mb'])
+        parts.append(f"{name} {stage['seconds']}s/{peak} MB")
+    return ', '.join(parts)
+
+
+class Command(BaseCommand):
+    help = 'Render element JSON files from directories or glob patterns to images and element data JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('inputs', nargs='+', help='JSON files, directories or glob patterns')
+        parser.add_argument('-o', '--output-dir', required=True, help='Directory for the rendered files')
+        parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(),
+                            help='Number of worker processes (default: CPU count)')
+        parser.add_argument('--image-format', choices=sorted(IMAGE_FORMATS), default=settings.VISUALIZER_IMAGE_FORMAT)
+        parser.add_argument('--dpi', type=int, default=settings.VISUALIZER_DPI)
+        parser.add_argument('--show-other-families', action='store_true',
+                            help='Include elements from families other than KIT(DS)1')
+        parser.add_argument('--label', action='append', default=[], metavar='PATTERN',
+                            help='Family to label, as glob or re:<regex> (repeatable, default KIT(DS)1)')
+        parser.add_argument('--gray', action='append', default=[], metavar='PATTERN',
+                            help='Family to draw in gray (repeatable, overrides --show-other-families)')
+        parser.add_argument('--hide', action='append', default=[], metavar='PATTERN',
+                            help='Family to leave out (repeatable)')
+        parser.add_argument('--raster-threshold', type=int, default=settings.VISUALIZER_RASTER_THRESHOLD,
+                            help='Element count from which the raster renderer is used instead of matplotlib')
+        parser.add_argument('--lod-pixels', type=int, default=settings.VISUALIZER_LOD_PIXELS,
+                            help='Group elements drawn closer than this many pixels (0 to label every element)')
+        parser.add_argument('--max-labels', type=int,
+                            help='Only place tags for the first N KIT(DS)1 elements of each file')
+        parser.add_argument('--track-memory', action='store_true',
+                            help='Report the tracemalloc peak of every pipeline stage (slow)')
+        parser.add_argument('--profile', action='store_true',
+                            help='Write <name>.profile.pstats, .collapsed.txt and .allocations.txt for each input')
+        parser.add_argument('--force', action='store_true', help='Render inputs whose outputs are up to date')
+
+    def _collect_inputs(self, patterns):
+        """
+        Expand directories and glob patterns into input files
+
+        Returns:
+            Dict of input path to its output stem (the path relative to the directory or
+            the fixed part of the glob pattern, without suffix), sorted by input path
+        """
+        inputs = {}
+        for pattern in patterns:
+            if os.path.isdir(pattern):
+                candidates = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+            else:
+                candidates = glob.glob(pattern, recursive=True)
+
+            root = _input_root(pattern)
+            for path in candidates:
+                if os.path.isfile(path) and path.lower().endswith(INPUT_SUFFIXES) and path not in inputs:
+                    inputs[path] = _output_stem(os.path.relpath(path, root or os.curdir))
+        return dict(sorted(inputs.items()))
+
+    def _check_output_collisions(self, inputs):
+        """Fail if inputs would write the same output files, e.g. a/plan.json and a/plan.json.gz"""
+        inputs_by_stem = {}
+        for input_path, stem in inputs.items():
+            inputs_by_stem.setdefault(os.path.normcase(stem), []).append(input_path)
+
+        collisions = [paths for paths in inputs_by_stem.values() if len(paths) > 1]
+        if collisions:
+            raise CommandError(
+                'These inputs would write the same output files: '
+                + '; '.join(' and '.join(paths) for paths in collisions)
+            )
+
+    def handle(self, *args, **options):
+        inputs = self._collect_inputs(options['inputs'])
+        if not inputs:
+            raise CommandError('No JSON files found.')
+        self._check_output_collisions(inputs)
+
+        try:
+            families = FamilySelection(
+                label=options['label'],
+                gray=options['gray'] or (['*'] if options['show_other_families'] else []),
+                hide=options['hide'],
+            )
+        except FamilyRuleError as e:
+            raise CommandError(str(e))
+
+        output_dir = options['output_dir']
+        os.makedirs(output_dir, exist_ok=True)
+
+        render = functools.partial(
+            render_file,
+            families=families,
+            max_inflated_size=settings.VISUALIZER_MAX_INFLATED_SIZE,
+            image_format=options['image_format'],
+            dpi=options['dpi'],
+            compress_level=settings.VISUALIZER_PNG_COMPRESS_LEVEL,
+            webp_method=settings.VISUALIZER_WEBP_METHOD,
+            max_labels=options['max_labels'],
+            raster_threshold=options['raster_threshold'],
+            lod_pixels=options['lod_pixels'],
+            track_memory=options['track_memory'],
+        )
+
+        # Skip inputs whose outputs are newer than the input
+        jobs = []
+        skipped = 0
+        for input_path, output_stem in inputs.items():
+            stem = os.path.join(output_dir, output_stem)
+            os.makedirs(os.path.dirname(stem), exist_ok=True)
+            image_path = f"{stem}.{image_extension(options['image_format'])}"
+            element_data_path = f'{stem}.elements.json'
+            profile_path = f'{stem}.profile' if options['profile'] else None
+
+            if not options['force'] and _is_up_to_date(input_path, [image_path, element_data_path]):
+                skipped += 1
+            else:
+                jobs.append((input_path, image_path, element_data_path, profile_path))
+
+        self.stdout.write(f'{len(jobs)} file(s) to render, {skipped} up to date')
+
+        rendered = failed = total_elements = 0
+        start = time.perf_counter()
+
+        with ProcessPoolExecutor(max_workers=max(1, options['workers'])) as executor:
+            futures = {
+                executor.submit(render, input_path, image_path, element_data_path, profile_path=profile_path): input_path
+                for input_path, image_path, element_data_path, profile_path in jobs
+            }
+
+            for future in as_completed(futures):
+                input_path = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {'error': str(e)}
+
+                if 'error' in result:
+                    failed += 1
+                    self.stderr.write(f"{input_path}: {result['error']}")
+                else:
+                    rendered += 1
+                    total_elements += result['elements']
+                    self.stdout.write(
+                        f"{input_path}: {result['elements']} elements, {result['tags']} tags, "
+                        f"{_format_memory(result['memory'])}"
+                    )
+                    if result['profile']:
+                        self.stdout.write(f"  profile: {', '.join(sorted(result['profile'].values()))}")
+
+        elapsed = time.perf_counter() - start
+        rate = f'{rendered / elapsed:.2f} files/s, {total_elements / elapsed:,.0f} elements/s' if elapsed else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'Rendered {rendered}, skipped {skipped}, failed {failed} in {elapsed:.1f}s {rate}'.rstrip()
+        ))
@@ -0,0 +1,283 @@
+# visualizer/memory.py
+import os
+import struct
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+from .uploads import detect_compression, zstandard
+
+# Approximate memory cost of each part of the pipeline, measured with tracemalloc
+# on matplotlib 3.7+. Estimates deliberately err on the high side.
+BYTES_PER_ELEMENT_JSON = 200  # Compact JSON size of one element (lower bound, so counts are overestimated)
+ELEMENT_BYTES = 600  # Element object, its attributes and list slots
+TAG_BYTES = 500  # Tag object plus placement bookkeeping
+ELEMENT_ARTIST_BYTES = 8 * 1024  # matplotlib Rectangle for an element
+TAG_ARTIST_BYTES = 32 * 1024  # Rectangle, Text and Line2D for a tag
+PIXEL_BYTES = 12  # Agg RGBA buffer, RGB copy and encoder buffers per pixel
+MAX_FIGURE_AREA = 12 * 8  # Largest figure size compute_view_layout picks for pipeline.render, in square inches
+FIXED_BYTES = 16 * 1024 * 1024  # Figure, axes, ticks and fonts
+COMPRESSION_RATIO = 20  # Assumed inflation of compressed uploads of unknown size
+
+# Lower DPI steps tried before dropping labels
+DOWNGRADE_DPIS = (100, 72)
+
+# Seconds between RSS samples taken while a stage runs
+RSS_SAMPLE_INTERVAL = 0.01
+
+
+class AdmissionError(Exception):
+    """Raised when an upload is too large to be rendered within the memory budget"""
+
+
+class MemoryBudgetBusy(Exception):
+    """Raised when memory for an upload did not become available in time"""
+
+
+def estimate_inflated_size(upload, upload_size, upload_name=None, content_encoding=None):
+    """Returns the (estimated) decompressed size of an upload in bytes"""
+    compression = detect_compression(upload, upload_name, content_encoding)
+    if compression is None:
+        return upload_size
+
+    seekable = getattr(upload, 'seekable', lambda: False)()
+    if seekable and compression == 'gzip' and upload_size >= 4:
+        # The gzip trailer stores the inflated size modulo 4 GiB
+        upload.seek(-4, os.SEEK_END)
+        inflated_size = struct.unpack('<I', upload.read(4))[0]
+        upload.seek(0)
+        if inflated_size >= upload_size:
+            return inflated_size
+    elif seekable and compression == 'zstd' and zstandard is not None:
+        header = upload.read(18)
+        upload.seek(0)
+        try:
+            inflated_size = zstandard.frame_content_size(header)
+        except zstandard.ZstdError:
+            inflated_size = -1
+        if inflated_size >= 0:
+            return inflated_size
+
+    return upload_size * COMPRESSION_RATIO
+
+
+def estimate_peak_memory(element_count, label_count, dpi):
+    """
+    Predict the peak memory needed to render a model
+
+    Args:
+        element_count: Number of elements drawn
+        label_count: Number of elements that get a tag
+        dpi: Resolution of the image
+
+    Returns:
+        Estimated peak memory in bytes
+    """
+    return (
+        FIXED_BYTES
+        + element_count * (ELEMENT_BYTES + ELEMENT_ARTIST_BYTES)
+        + label_count * (TAG_BYTES + TAG_ARTIST_BYTES)
+        + MAX_FIGURE_AREA * dpi * dpi * PIXEL_BYTES
+    )
+
+
+def plan_admission(inflated_size, dpi, budget, min_dpi=72, min_labels=500):
+    """
+    Decide how an upload can be rendered within the memory budget
+
+    Lowers the DPI first, then labels only a subset of the elements. Uploads that do
+    not fit even then are rejected.
+
+    Returns:
+        Tuple of (estimated bytes, dpi, max_labels), max_labels is None when all elements are labeled
+
+    Raises:
+        AdmissionError: If the upload cannot be rendered within the budget
+    """
+    element_count = max(1, inflated_size // BYTES_PER_ELEMENT_JSON)
+
+    estimate = estimate_peak_memory(element_count, element_count, dpi)
+    if estimate <= budget:
+        return estimate, dpi, None
+
+    for lower_dpi in DOWNGRADE_DPIS:
+        if min_dpi <= lower_dpi < dpi:
+            dpi = lower_dpi
+            estimate = estimate_peak_memory(element_count, element_count, dpi)
+            if estimate <= budget:
+                return estimate, dpi, None
+
+    # Label as many elements as still fit
+    unlabeled_estimate = estimate_peak_memory(element_count, 0, dpi)
+    max_labels = int((budget - unlabeled_estimate) // (TAG_BYTES + TAG_ARTIST_BYTES))
+    if max_labels < min_labels:
+        raise AdmissionError(
+            f'This file has about {element_count:,} elements and needs an estimated '
+            f'{unlabeled_estimate / 2 ** 20:,.0f} MB to render, which exceeds the server limit of '
+            f'{budget / 2 ** 20:,.0f} MB. Please split it into smaller files.'
+        )
+
+    return estimate_peak_memory(element_count, max_labels, dpi), dpi, max_labels
+
+
+class MemoryBudget:
+    """
+    Memory budget shared by the concurrent renders of one process
+
+    Each server process has its own budget, so N server processes may use N times
+    total_bytes between them.
+    """
+
+    def __init__(self, total_bytes):
+        self.total_bytes = total_bytes
+        self.reserved_bytes = 0
+        self._condition = threading.Condition()
+
+    def reserve(self, nbytes, timeout=None):
+        """
+        Wait until nbytes fit into the budget and reserve them
+
+        Raises:
+            MemoryBudgetBusy: If the memory did not become available within timeout seconds
+        """
+        # Never wait for more than the whole budget
+        nbytes = min(nbytes, self.total_bytes)
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.reserved_bytes + nbytes <= self.total_bytes, timeout):
+                raise MemoryBudgetBusy()
+            self.reserved_bytes += nbytes
+        return nbytes
+
+    def release(self, nbytes):
+        """Return memory reserved with reserve()"""
+        with self._condition:
+            self.reserved_bytes -= nbytes
+            self._condition.notify_all()
+
+
+def process_rss(pid):
+    """Returns the resident set size of a process in bytes, or None if unknown (Linux only)"""
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def max_rss():
+    """Returns the highest resident set size this process has reached in bytes, or None if unknown"""
+    if resource is None:
+        return None
+    # Kilobytes on Linux, bytes on macOS
+    value = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return value if os.uname().sysname == 'Darwin' else value * 1024
+
+
+def current_rss():
+    """Returns the resident set size of this process in bytes, or None if unknown"""
+    rss = process_rss('self')
+    if rss is not None:
+        return rss
+    # Peak rather than current RSS
+    return max_rss()
+
+
+class RssSampler(threading.Thread):
+    """Records the highest RSS of this process while running"""
+
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL):
+        super().__init__(name='visualizer-rss-sampler', daemon=True)
+        self.interval = interval
+        self.peak = None
+        self._stopped = threading.Event()
+
+    def _sample(self):
+        rss = current_rss()
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+
+    def run(self):
+        self._sample()
+        while not self._stopped.wait(self.interval):
+            self._sample()
+
+    def stop(self):
+        """Stop sampling and return the peak, including a final sample"""
+        self._stopped.set()
+        self.join()
+        self._sample()
+        return self.peak
+
+
+class MemoryTracker:
+    """
+    Records time and memory usage of each pipeline stage
+
+    The peak RSS of a stage is sampled every RSS_SAMPLE_INTERVAL seconds while it
+    runs, so buffers freed before the stage ends are still counted. A new process-wide
+    maximum (ru_maxrss) reached during the stage also counts, catching spikes between
+    samples. RSS is process-wide and includes concurrent work in other threads.
+    """
+
+    def __init__(self, use_tracemalloc=False):
+        self.use_tracemalloc = use_tracemalloc
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        started_tracing = False
+        if self.use_tracemalloc:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            tracemalloc.reset_peak()
+        traced_start = tracemalloc.get_traced_memory()[0] if self.use_tracemalloc else 0
+        max_rss_start = max_rss()
+        sampler = RssSampler()
+        sampler.start()
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            peak_rss = sampler.stop()
+            max_rss_end = max_rss()
+            if max_rss_end is not None and max_rss_start is not None and max_rss_end > max_rss_start:
+                peak_rss = max(peak_rss or 0, max_rss_end)
+            record = {
+                'seconds': round(seconds, 3),
+                'rss_mb': _to_mb(current_rss()),
+                'peak_rss_mb': _to_mb(peak_rss),
+            }
+            if self.use_tracemalloc:
+                record['traced_peak_mb'] = _to_mb(tracemalloc.get_traced_memory()[1] - traced_start)
+                if started_tracing:
+                    tracemalloc.stop()
+            self.stages[name] = record
+
+    @property
+    def peak_rss_mb(self):
+        """Highest RSS reached during any stage"""
+        samples = [stage['peak_rss_mb'] for stage in self.stages.values() if stage['peak_rss_mb'] is not None]
+        return max(samples) if samples else None
+
+    def summary(self):
+        """Returns a one-line description of all stages"""
+        parts = []
+        for name, stage in self.stages.items():
+            part = f"{name}: {stage['seconds']}s, rss {stage['rss_mb']} MB, peak rss {stage['peak_rss_mb']} MB"
+            if 'traced_peak_mb' in stage:
+                part += f", traced peak {stage['traced_peak_mb']} MB"
+            parts.append(part)
+        return '; '.join(parts)
+
+
+def _to_mb(nbytes):
+    return round(nbytes / 2 ** 20, 1) if nbytes is not None else None
@@ -0,0 +1,377 @@
+# visualizer/pipeline.py
+import base64
+import io
+import json
+import logging
+import os
+
+from .families import FamilyIndex, FamilySelection
+from .lod import LOD_PIXEL_THRESHOLD, apply_level_of_detail, count_grouped
+from .memory import MemoryTracker
+from .profiling import PipelineProfiler
+from .raster import RASTER_THRESHOLD, render_raster_image
+from .uploads import UploadError, open_upload
+from .utils import (
+    IMAGE_FORMATS, parse_json_stream, place_tags_grid_snapping, generate_preview,
+    create_element_data_json, render_image
+)
+
+# Files written to a result directory by render_to_directory
+STATUS_FILE = 'status.json'
+IMAGE_FILE = 'visualization'
+ELEMENT_DATA_FILE = 'elements.json'
+PROFILE_FILE = 'profile'
+
+logger = logging.getLogger(__name__)
+
+
+class VisualizationError(Exception):
+    """Raised when an upload cannot be turned into a visualization"""
+
+
+def load_elements(upload, upload_name=None, content_encoding=None, show_other_families=False,
+                  max_inflated_size=None, families=None):
+    """
+    Decompress and parse an upload and split its elements by family
+
+    Args:
+        families: FamilySelection choosing the labeled and gray families, by default
+            KIT(DS)1 is labeled and other families are shown if show_other_families is set
+
+    Returns:
+        Tuple of (FamilyIndex of all elements, elements to label, elements to draw in gray)
+    """
+    # Decompress and parse the upload as a stream
+    try:
+        stream = open_upload(upload, upload_name, content_encoding, max_inflated_size=max_inflated_size)
+        elements = parse_json_stream(stream)
+    except UploadError as e:
+        raise VisualizationError(str(e))
+
+    if not elements:
+        raise VisualizationError('No valid elements found in the JSON file.')
+
+    # Selecting families is a lookup in the index instead of a pass over all elements
+    if families is None:
+        families = FamilySelection.default(show_other_families)
+    index = FamilyIndex(elements)
+    kit_elements, other_elements = index.split(families)
+
+    if not kit_elements:
+        raise VisualizationError('No elements of the families selected for labeling found in the JSON file.')
+
+    return index, kit_elements, other_elements
+
+
+def place_tags(kit_elements, other_elements, tag_size=12, max_labels=None):
+    """Place tags, labeling only the first max_labels elements if given"""
+    if max_labels is None or len(kit_elements) <= max_labels:
+        return place_tags_grid_snapping(kit_elements, other_elements, tag_size)
+
+    # Unlabeled elements still keep tags from being placed over them
+    return place_tags_grid_snapping(
+        kit_elements[:max_labels], kit_elements[max_labels:] + other_elements, tag_size
+    )
+
+
+def render(kit_elements, tags, other_elements, image_format='png', dpi=150, compress_level=6,
+           webp_method=4, raster_threshold=RASTER_THRESHOLD):
+    """
+    Render the elements and tags to image bytes
+
+    Uses matplotlib, or the raster renderer for models with raster_threshold or more
+    elements (never if raster_threshold is None)
+    """
+    element_count = len(kit_elements) + len(other_elements)
+    renderer = render_image
+    if raster_threshold is not None and element_count >= raster_threshold:
+        renderer = render_raster_image
+
+    logger.debug('Rendering %d elements with %s', element_count, renderer.__name__)
+    return renderer(kit_elements, tags, other_elements, image_format, dpi, compress_level, webp_method)
+
+
+def run_stages(upload, upload_name=None, content_encoding=None, show_other_families=False,
+               max_inflated_size=None, tag_size=12, image_format='png', dpi=150, compress_level=6,
+               webp_method=4, max_labels=None, track_memory=False, families=None, profile=False,
+               raster_threshold=RASTER_THRESHOLD, lod_pixels=LOD_PIXEL_THRESHOLD):
+    """
+    Run the parse, level of detail, tag placement and render stages for one upload
+
+    Each stage is measured by a MemoryTracker, and the whole run is profiled with a
+    PipelineProfiler if profile is set (save the profile with profiler.save).
+
+    Returns:
+        Tuple of (FamilyIndex of all elements, elements to label, elements drawn in gray,
+        tags, image bytes, MemoryTracker, PipelineProfiler). Dense clusters of the labeled
+        and gray elements are replaced by ElementGroups.
+
+    Raises:
+        VisualizationError: If the upload cannot be parsed or has no elements to label
+    """
+    tracker = MemoryTracker(use_tracemalloc=track_memory)
+    profiler = PipelineProfiler(enabled=profile)
+
+    with profiler:
+        with tracker.stage('parse'):
+            index, kit_elements, other_elements = load_elements(
+                upload, upload_name, content_encoding, show_other_families, max_inflated_size, families
+            )
+
+        # Group dense clusters into markers, so placement and rendering only see what is visible
+        with tracker.stage('lod'):
+            kit_elements, other_elements = apply_level_of_detail(kit_elements, other_elements, dpi, lod_pixels)
+
+        # Generate tags with optimized positions
+        with tracker.stage('place'), profiler.allocations('place_tags_grid_snapping'):
+            tags = place_tags(kit_elements, other_elements, tag_size, max_labels)
+
+        # Generate visualization
+        with tracker.stage('render'), profiler.allocations('render'):
+            image_bytes = render(
+                kit_elements, tags, other_elements, image_format, dpi, compress_level, webp_method,
+                raster_threshold
+            )
+
+    return index, kit_elements, other_elements, tags, image_bytes, tracker, profiler
+
+
+def _count_elements(markers):
+    """Number of elements in a list of elements and ElementGroups"""
+    groups, grouped = count_grouped(markers)
+    return len(markers) - groups + grouped
+
+
+def run_visualization(upload, upload_name=None, content_encoding=None, show_other_families=False,
+                      max_inflated_size=None, tag_size=12, auto_scale=True,
+                      image_format='png', dpi=150, compress_level=6, webp_method=4,
+                      max_labels=None, track_memory=False, families=None, profile_path=None,
+                      raster_threshold=RASTER_THRESHOLD, lod_pixels=LOD_PIXEL_THRESHOLD):
+    """
+    Run the parse, tag placement and render stages for one upload
+
+    Args:
+        upload: Binary file-like object with the (possibly compressed) JSON data
+        upload_name: Optional file name used to detect compression
+        content_encoding: Optional Content-Encoding header value
+        show_other_families: Whether to include elements from other families
+        max_inflated_size: Maximum number of bytes to read after decompression
+        tag_size: Size of the tags
+        auto_scale: Whether to automatically scale elements
+        image_format: Output format, one of IMAGE_FORMATS
+        dpi: Resolution of the image
+        compress_level: zlib compression level for PNG output
+        webp_method: WebP encoder effort
+        max_labels: Optional limit on the number of tagged elements
+        track_memory: Whether to measure each stage with tracemalloc (RSS is always sampled)
+        families: Optional FamilySelection, overrides show_other_families
+        profile_path: Path prefix for profile files, the run is profiled if given
+        raster_threshold: Element count from which the raster renderer is used
+        lod_pixels: Elements closer than this many pixels are grouped, see apply_level_of_detail
+
+    Returns:
+        Dict with image_data, image_mime, element_data_json and stats for the result template,
+        plus profile_files (kind to file name) when profiled
+    """
+    index, kit_markers, other_markers, tags, image_bytes, tracker, profiler = run_stages(
+        upload, upload_name, content_encoding, show_other_families, max_inflated_size, tag_size,
+        image_format, dpi, compress_level, webp_method, max_labels, track_memory, families,
+        profile=profile_path is not None, raster_threshold=raster_threshold, lod_pixels=lod_pixels
+    )
+
+    logger.info('Rendered %d elements (%s)', len(index), tracker.summary())
+    element_groups, grouped_elements = count_grouped(kit_markers + other_markers)
+
+    # Statistics for the template
+    stats = {
+        'total_elements': len(index),
+        'kit_elements': _count_elements(kit_markers),
+        'other_elements': _count_elements(other_markers),
+        'tags_placed': len(tags),
+        'element_groups': element_groups,
+        'grouped_elements': grouped_elements,
+        'peak_memory_mb': tracker.peak_rss_mb,
+        'families': index.summary(),
+    }
+
+    return {
+        'image_data': base64.b64encode(image_bytes).decode('utf-8'),
+        'image_mime': IMAGE_FORMATS[image_format],
+        'element_data_json': create_element_data_json(kit_markers, other_markers),
+        'stats': stats,
+        'profile_files': profiler.save(profile_path) if profile_path else {},
+    }
+
+
+def run_preview(upload, upload_name=None, content_encoding=None, show_other_families=False,
+                max_inflated_size=None, image_format='png', dpi=50, families=None):
+    """
+    Parse an upload and render a quick, tag-free preview of its elements
+
+    Returns:
+        Dict like run_visualization's, with stats['tags_placed'] set to None
+    """
+    index, kit_elements, other_elements = load_elements(
+        upload, upload_name, content_encoding, show_other_families, max_inflated_size, families
+    )
+
+    image_data = generate_preview(kit_elements, other_elements, image_format=image_format, dpi=dpi)
+
+    stats = {
+        'total_elements': len(index),
+        'kit_elements': len(kit_elements),
+        'other_elements': len(other_elements),
+        'tags_placed': None,
+        'families': index.summary(),
+    }
+
+    return {
+        'image_data': image_data,
+        'image_mime': IMAGE_FORMATS[image_format],
+        'element_data_json': create_element_data_json(kit_elements, other_elements),
+        'stats': stats,
+    }
+
+
+def run_placement(upload, upload_name=None, content_encoding=None, show_other_families=False,
+                  max_inflated_size=None, tag_size=12, max_labels=None, families=None):
+    """
+    Parse an upload and place its tags without rendering anything
+
+    Dense clusters are not grouped, as grouping depends on the rendered image's
+    resolution, so every labeled element gets its own tag.
+
+    Returns:
+        List of placed Tag objects
+    """
+    _, kit_elements, other_elements = load_elements(
+        upload, upload_name, content_encoding, show_other_families, max_inflated_size, families
+    )
+    return place_tags(kit_elements, other_elements, tag_size, max_labels)
+
+
+def image_extension(image_format):
+    """Returns the file extension for an output image format"""
+    return IMAGE_FORMATS[image_format].split('/')[1]
+
+
+def _write_file(path, data):
+    """Write a file atomically so readers never see partial output"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def write_status(result_dir, status):
+    """Atomically write the status file of a result directory"""
+    _write_file(os.path.join(result_dir, STATUS_FILE), json.dumps(status).encode('utf-8'))
+
+
+def render_to_directory(result_dir, upload_name, show_other_families=False, max_inflated_size=None,
+                        tag_size=12, auto_scale=True, image_format='png', dpi=150,
+                        compress_level=6, webp_method=4, max_labels=None, track_memory=False,
+                        families=None, profile=False, raster_threshold=RASTER_THRESHOLD,
+                        lod_pixels=LOD_PIXEL_THRESHOLD):
+    """
+    Executor entry point rendering the full-resolution image for a stored upload
+
+    The upload is read from result_dir/upload_name. The image and the element data
+    JSON (with the dense clusters drawn as one marker) are written next to it, and
+    status.json records either their file names or the error message. With profile
+    set, profile files are written to the directory as well.
+    """
+    try:
+        with open(os.path.join(result_dir, upload_name), 'rb') as upload:
+            _, kit_elements, other_elements, tags, image_bytes, tracker, profiler = run_stages(
+                upload, upload_name, None, show_other_families, max_inflated_size, tag_size,
+                image_format, dpi, compress_level, webp_method, max_labels, track_memory, families,
+                profile=profile, raster_threshold=raster_threshold, lod_pixels=lod_pixels
+            )
+
+        image_name = f"{IMAGE_FILE}.{image_extension(image_format)}"
+        with open(os.path.join(result_dir, image_name), 'wb') as f:
+            f.write(image_bytes)
+        _write_file(
+            os.path.join(result_dir, ELEMENT_DATA_FILE),
+            create_element_data_json(kit_elements, other_elements).encode('utf-8')
+        )
+
+        logger.info('Rendered %s (%s)', result_dir, tracker.summary())
+        element_groups, grouped_elements = count_grouped(kit_elements + other_elements)
+        write_status(result_dir, {
+            'status': 'done',
+            'image': image_name,
+            'element_data': ELEMENT_DATA_FILE,
+            'tags_placed': len(tags),
+            'element_groups': element_groups,
+            'grouped_elements': grouped_elements,
+            'memory': tracker.stages,
+            'profile': profiler.save(os.path.join(result_dir, PROFILE_FILE)),
+        })
+    except Exception as e:
+        write_status(result_dir, {'status': 'error', 'error': str(e)})
+
+
+def render_file(input_path, image_path, element_data_path, show_other_families=False,
+                max_inflated_size=None, tag_size=12, auto_scale=True, image_format='png', dpi=150,
+                compress_level=6, webp_method=4, max_labels=None, track_memory=False, families=None,
+                profile_path=None, raster_threshold=RASTER_THRESHOLD, lod_pixels=LOD_PIXEL_THRESHOLD):
+    """
+    Executor entry point rendering a JSON file on disk to an image and element data JSON
+
+    Returns:
+        Dict with the number of elements and tags, the memory used per stage and the
+        profile files written to profile_path (if given), or the error message
+    """
+    try:
+        with open(input_path, 'rb') as upload:
+            index, kit_elements, other_elements, tags, image_bytes, tracker, profiler = run_stages(
+                upload, input_path, None, show_other_families, max_inflated_size, tag_size,
+                image_format, dpi, compress_level, webp_method, max_labels, track_memory, families,
+                profile=profile_path is not None, raster_threshold=raster_threshold, lod_pixels=lod_pixels
+            )
+    except VisualizationError as e:
+        return {'error': str(e)}
+
+    _write_file(image_path, image_bytes)
+    _write_file(element_data_path, create_element_data_json(kit_elements, other_elements).encode('utf-8'))
+
+    return {
+        'elements': len(index),
+        'tags': len(tags),
+        'memory': tracker.stages,
+        'profile': profiler.save(profile_path) if profile_path else {},
+    }
+
+
+def run_preview_job(path, **kwargs):
+    """
+    Executor entry point for run_preview
+
+    Args:
+        path: Path of the stored upload
+        **kwargs: Passed through to run_preview
+
+    Returns:
+        Dict with image_data, image_mime, element_data_json and stats for the result template
+    """
+    with open(path, 'rb') as upload:
+        return run_preview(upload, **kwargs)
+
+
+def run_visualization_job(source, **kwargs):
+    """
+    Executor entry point for run_visualization
+
+    Args:
+        source: Upload contents as bytes, or a path to a file on disk
+        **kwargs: Passed through to run_visualization
+
+    Returns:
+        Dict with image_data, image_mime, element_data_json and stats for the result template
+    """
+    if isinstance(source, (bytes, bytearray)):
+        return run_visualization(io.BytesIO(source), **kwargs)
+    with open(source, 'rb') as upload:
+        return run_visualization(upload, **kwargs)
@@ -0,0 +1,147 @@
+# visualizer/profiling.py
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+# Suffixes of the files written by PipelineProfiler.save, by kind
+PROFILE_SUFFIXES = {
+    'pstats': '.pstats',  # cProfile statistics, for pstats/snakeviz
+    'collapsed': '.collapsed.txt',  # Sampled stacks, for flamegraph.pl/speedscope
+    'allocations': '.allocations.txt',  # tracemalloc peak and top allocators per stage
+}
+
+# Seconds between stack samples
+SAMPLE_INTERVAL = 0.005
+
+# Number of allocation sites reported per stage
+TOP_ALLOCATORS = 25
+
+
+class StackSampler(threading.Thread):
+    """Periodically records the Python stack of one thread as collapsed stacks"""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        super().__init__(name='visualizer-stack-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def write_collapsed(self, path):
+        """Write one 'frame;frame;frame count' line per distinct stack"""
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class PipelineProfiler:
+    """
+    Profiles a pipeline run in the current thread
+
+    Runs cProfile and a stack sampler while active, and records the tracemalloc peak
+    and top allocators of the stages wrapped in allocations(). Does nothing unless enabled.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.allocators = {}
+        self.traced_peaks = {}
+        self._profile = None
+        self._sampler = None
+
+    def __enter__(self):
+        if self.enabled:
+            self._sampler = StackSampler(threading.get_ident())
+            self._sampler.start()
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.enabled:
+            self._profile.disable()
+            self._sampler.stop()
+        return False
+
+    @contextmanager
+    def allocations(self, name):
+        """
+        Record the traced peak and top allocation sites of a block under the given name
+
+        The peak includes buffers freed before the block ends, which the allocation
+        sites (a snapshot taken at the end) do not show.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        traced_start = tracemalloc.get_traced_memory()[0]
+        try:
+            yield
+        finally:
+            self.traced_peaks[name] = tracemalloc.get_traced_memory()[1] - traced_start
+            # Leave out the profiler's own bookkeeping
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+            ])
+            self.allocators[name] = snapshot.statistics('lineno')[:TOP_ALLOCATORS]
+            if started_tracing:
+                tracemalloc.stop()
+
+    def save(self, path_prefix):
+        """
+        Write the profile files
+
+        Args:
+            path_prefix: Path without suffix, e.g. <result dir>/profile
+
+        Returns:
+            Dict of file kind to file name (without directory), empty if not enabled
+        """
+        if not self.enabled:
+            return {}
+
+        paths = {kind: path_prefix + suffix for kind, suffix in PROFILE_SUFFIXES.items()}
+
+        self._profile.dump_stats(paths['pstats'])
+        self._sampler.write_collapsed(paths['collapsed'])
+
+        with open(paths['allocations'], 'w') as f:
+            for name, statistics in self.allocators.items():
+                f.write(f'Traced peak of {name}: {self.traced_peaks[name] / 2 ** 20:,.1f} MB\n')
+                f.write(f'Top {len(statistics)} allocators still allocated at the end of {name}:\n')
+                for stat in statistics:
+                    f.write(f'  {stat}\n')
+                f.write('\n')
+
+            # Also include the slowest functions, so the text files alone tell the story
+            f.write('Slowest functions by cumulative time:\n')
+            stats = pstats.Stats(self._profile, stream=f)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(20)
+
+        return {kind: os.path.basename(path) for kind, path in paths.items()}
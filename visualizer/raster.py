@@ -0,0 +1,246 @@
+# visualizer/raster.py
+from functools import lru_cache
+
+import numpy as np
+from matplotlib import font_manager
+from matplotlib.colors import to_rgb
+from matplotlib.ticker import MaxNLocator
+from PIL import Image, ImageDraw, ImageFont
+
+from .utils import compute_view_layout, encode_image
+
+# Models with at least this many elements are drawn with render_raster_image by default
+RASTER_THRESHOLD = 20000
+
+# Sizes below are in points, as in render_image, and scaled by dpi / 72
+POINTS_PER_INCH = 72
+LAYOUT_PAD = 2.5 * 10  # tight_layout(pad=2.5) with the default 10 pt font
+TITLE_PAD = 20
+TICK_LENGTH = 3.5
+TICK_PAD = 3.5
+LABEL_PAD = 4
+FRAME_WIDTH = 0.8
+GRID_DASH = (3.7 * 0.8, 1.6 * 0.8)
+
+ELEMENT_ALPHA = 0.7
+TAG_ALPHA = 0.9
+# Matplotlib's default grid color (#b0b0b0) at alpha 0.5 over white
+GRID_COLOR = (216, 216, 216)
+
+
+@lru_cache(maxsize=64)
+def _font(size_px, bold=False):
+    """Returns the DejaVu Sans font matplotlib uses, at a size in pixels"""
+    path = font_manager.findfont(
+        font_manager.FontProperties(family='DejaVu Sans', weight='bold' if bold else 'normal')
+    )
+    return ImageFont.truetype(path, max(1, size_px))
+
+
+def _text_size(font, text):
+    left, top, right, bottom = font.getbbox(text)
+    return right - left, bottom - top
+
+
+def _ticks(low, high):
+    """Major tick positions within the limits, as chosen by matplotlib's MaxNLocator(10)"""
+    return [value for value in MaxNLocator(10).tick_values(low, high) if low <= value <= high]
+
+
+def _draw_dashed_line(draw, start, end, dash, width, fill):
+    """Draw a horizontal or vertical dashed line"""
+    (x0, y0), (x1, y1) = start, end
+    length = max(abs(x1 - x0), abs(y1 - y0))
+    position = 0.0
+    while position < length:
+        stop = min(position + dash[0], length)
+        t0, t1 = position / length, stop / length
+        draw.line(
+            [(x0 + (x1 - x0) * t0, y0 + (y1 - y0) * t0), (x0 + (x1 - x0) * t1, y0 + (y1 - y0) * t1)],
+            fill=fill, width=width
+        )
+        position += dash[0] + dash[1]
+
+
+def _blend_rectangles(canvas, boxes, colors, alpha):
+    """
+    Alpha-blend filled rectangles into a float RGB array
+
+    Args:
+        canvas: Array of shape (height, width, 3)
+        boxes: Integer array of (x0, y0, x1, y1) pixel boxes, end exclusive
+        colors: Array of RGB colors (0-255), one per box
+        alpha: Opacity of the fill
+    """
+    keep = (boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])
+    for (x0, y0, x1, y1), color in zip(boxes[keep].tolist(), colors[keep] * alpha):
+        region = canvas[y0:y1, x0:x1]
+        region *= 1 - alpha
+        region += color
+
+
+class _PixelTransform:
+    """Maps data coordinates into the axes box of the image"""
+
+    def __init__(self, limits, box):
+        min_x, max_x, min_y, max_y = limits
+        self.left, self.top, self.right, self.bottom = box
+        self.min_x, self.min_y = min_x, min_y
+        self.scale_x = (self.right - self.left) / (max_x - min_x)
+        self.scale_y = (self.bottom - self.top) / (max_y - min_y)
+
+    def x(self, values):
+        return self.left + (np.asarray(values, dtype=float) - self.min_x) * self.scale_x
+
+    def y(self, values):
+        return self.bottom - (np.asarray(values, dtype=float) - self.min_y) * self.scale_y
+
+    def boxes(self, min_x, min_y, max_x, max_y, grow=0.0):
+        """Pixel boxes (x0, y0, x1, y1) of data rectangles, grown by grow pixels and clipped to the axes"""
+        x0 = np.floor(self.x(min_x) - grow)
+        x1 = np.ceil(self.x(max_x) + grow)
+        y0 = np.floor(self.y(max_y) - grow)
+        y1 = np.ceil(self.y(min_y) + grow)
+        boxes = np.stack([x0, y0, np.maximum(x1, x0 + 1), np.maximum(y1, y0 + 1)], axis=1)
+        lower = [self.left, self.top, self.left, self.top]
+        upper = [self.right, self.bottom, self.right, self.bottom]
+        return np.clip(boxes, lower, upper).astype(np.int64)
+
+
+def render_raster_image(kit_elements, tags, other_elements=None, image_format='png', dpi=150,
+                        compress_level=6, webp_method=4):
+    """
+    Render the elements and tags directly into a pixel array
+
+    Follows the visual contract of render_image (element rectangles in
+    Element.get_color, white tag boxes with colored borders, bold ID text and
+    leader lines, titled and labeled axes with a grid) without creating a matplotlib
+    artist per element, which keeps very large models practical.
+
+    Args:
+        kit_elements: List of Element objects to label (KIT(DS)1 family by default)
+        tags: List of Tag objects with positions
+        other_elements: Optional list of other Element objects
+        image_format: Output format, one of IMAGE_FORMATS
+        dpi: Resolution of the image
+        compress_level: zlib compression level for PNG output
+        webp_method: WebP encoder effort
+
+    Returns:
+        Encoded image bytes
+    """
+    all_elements = kit_elements + (other_elements or [])
+    limits, (fig_width, fig_height) = compute_view_layout(all_elements, tags)
+    min_x, max_x, min_y, max_y = limits
+    width, height = int(fig_width * dpi), int(fig_height * dpi)
+    px = dpi / POINTS_PER_INCH
+
+    tick_font = _font(round(10 * px))
+    label_font = _font(round(12 * px))
+    title_font = _font(round(14 * px))
+
+    x_ticks, y_ticks = _ticks(min_x, max_x), _ticks(min_y, max_y)
+    x_labels = [f'{value:.2f}' for value in x_ticks]
+    y_labels = [f'{value:.2f}' for value in y_ticks]
+
+    # Margins around the axes, as tight_layout would compute them
+    tick_label_height = _text_size(tick_font, '0.123456789-')[1]
+    y_tick_label_width = max((_text_size(tick_font, label)[0] for label in y_labels), default=0)
+    x_label_size = _text_size(label_font, 'X Coordinate')
+    y_label_size = _text_size(label_font, 'Y Coordinate')
+    title_size = _text_size(title_font, 'Element Visualization')
+    last_x_label_overhang = _text_size(tick_font, x_labels[-1])[0] / 2 if x_labels else 0
+
+    pad = LAYOUT_PAD * px
+    left = pad + y_label_size[1] + (LABEL_PAD + TICK_PAD + TICK_LENGTH) * px + y_tick_label_width
+    right = width - pad - last_x_label_overhang
+    top = pad + title_size[1] + TITLE_PAD * px
+    bottom = height - (pad + x_label_size[1] + (LABEL_PAD + TICK_PAD + TICK_LENGTH) * px + tick_label_height)
+    box = (round(left), round(top), round(right), round(bottom))
+    transform = _PixelTransform(limits, box)
+
+    canvas = np.full((height, width, 3), 255, dtype=np.float32)
+
+    # Element rectangles; their outline (2 pt for labeled, 1.5 pt for other elements)
+    # extends the filled area by half the line width
+    rgb_by_color = {}
+    for element in all_elements:
+        color = element.get_color()
+        if color not in rgb_by_color:
+            rgb_by_color[color] = np.array(to_rgb(color)) * 255
+    element_bounds = np.array(
+        [(e.min_x, e.min_y, e.min_x + e.width, e.min_y + e.height) for e in all_elements], dtype=float
+    ).reshape(-1, 4)
+    line_widths = np.array([2 if e.is_labeled else 1.5 for e in all_elements]) * px
+    element_boxes = transform.boxes(*element_bounds.T, grow=line_widths / 2)
+    element_colors = np.array([rgb_by_color[e.get_color()] for e in all_elements]).reshape(-1, 3)
+    _blend_rectangles(canvas, element_boxes, element_colors, ELEMENT_ALPHA)
+
+    # White tag boxes
+    tag_bounds = np.array([(t.x, t.y, t.x + t.width, t.y + t.height) for t in tags], dtype=float).reshape(-1, 4)
+    tag_boxes = transform.boxes(*tag_bounds.T)
+    _blend_rectangles(canvas, tag_boxes, np.full((len(tags), 3), 255.0), TAG_ALPHA)
+
+    image = Image.fromarray(canvas.round().astype(np.uint8), 'RGB')
+    draw = ImageDraw.Draw(image)
+    line_width = max(1, round(1.5 * px))
+
+    # Tag borders in the color of their element
+    tag_colors = [tuple(int(c) for c in rgb_by_color[t.element.get_color()]) for t in tags]
+    for (x0, y0, x1, y1), color in zip(tag_boxes.tolist(), tag_colors):
+        draw.rectangle([x0, y0, x1 - 1, y1 - 1], outline=color, width=line_width)
+
+    # Major grid lines
+    grid_width = max(1, round(FRAME_WIDTH * px))
+    dash = (GRID_DASH[0] * px, GRID_DASH[1] * px)
+    for x in transform.x(x_ticks).tolist():
+        _draw_dashed_line(draw, (x, box[1]), (x, box[3]), dash, grid_width, GRID_COLOR)
+    for y in transform.y(y_ticks).tolist():
+        _draw_dashed_line(draw, (box[0], y), (box[2], y), dash, grid_width, GRID_COLOR)
+
+    # Leader lines from elements to the center of their tags
+    if tags:
+        start_x = transform.x([t.line_start_x for t in tags]).tolist()
+        start_y = transform.y([t.line_start_y for t in tags]).tolist()
+        end_x = transform.x(tag_bounds[:, [0, 2]].mean(axis=1)).tolist()
+        end_y = transform.y(tag_bounds[:, [1, 3]].mean(axis=1)).tolist()
+        for sx, sy, ex, ey, color in zip(start_x, start_y, end_x, end_y, tag_colors):
+            draw.line([(sx, sy), (ex, ey)], fill=color, width=line_width)
+
+        # Tag text, with the font size based on tag height as in render_image
+        for tag, cx, cy in zip(tags, end_x, end_y):
+            font = _font(round(max(tag.height * 0.85, 9) * px), bold=True)
+            draw.text((cx, cy), tag.text, fill='black', font=font, anchor='mm')
+
+    # Axes frame, ticks and tick labels
+    draw.rectangle(box, outline='black', width=grid_width)
+    tick_length = TICK_LENGTH * px
+    tick_pad = (TICK_LENGTH + TICK_PAD) * px
+    for x, label in zip(transform.x(x_ticks).tolist(), x_labels):
+        draw.line([(x, box[3]), (x, box[3] + tick_length)], fill='black', width=grid_width)
+        draw.text((x, box[3] + tick_pad), label, fill='black', font=tick_font, anchor='mt')
+    for y, label in zip(transform.y(y_ticks).tolist(), y_labels):
+        draw.line([(box[0] - tick_length, y), (box[0], y)], fill='black', width=grid_width)
+        draw.text((box[0] - tick_pad, y), label, fill='black', font=tick_font, anchor='rm')
+
+    # Axis labels and title
+    label_offset = tick_pad + LABEL_PAD * px
+    draw.text(
+        ((box[0] + box[2]) / 2, box[3] + label_offset + tick_label_height), 'X Coordinate',
+        fill='black', font=label_font, anchor='mt'
+    )
+    y_label = Image.new('L', (y_label_size[0] + 4, y_label_size[1] + 4), 0)
+    ImageDraw.Draw(y_label).text((2, 2), 'Y Coordinate', fill=255, font=label_font, anchor='lt')
+    y_label = y_label.rotate(90, expand=True)
+    image.paste(
+        (0, 0, 0),
+        (round(box[0] - label_offset - y_tick_label_width - y_label.width),
+         round((box[1] + box[3] - y_label.height) / 2)),
+        y_label
+    )
+    draw.text(
+        ((box[0] + box[2]) / 2, box[1] - TITLE_PAD * px), 'Element Visualization',
+        fill='black', font=title_font, anchor='mb'
+    )
+
+    return encode_image(image, image_format, compress_level, webp_method)
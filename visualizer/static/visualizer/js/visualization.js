@@ -7,8 +7,96 @@ document.addEventListener('DOMContentLoaded', function() {
 
     // Setup only the element info popup functionality
     setupElementInfoPopup(visualizationImg);
+
+    // Swap the preview for the full-resolution image once it is rendered
+    if (visualizationImg.dataset.statusUrl) {
+        pollFullRender(visualizationImg);
+    }
 });
 
+function pollFullRender(visualizationImg) {
+    const statusUrl = visualizationImg.dataset.statusUrl;
+    const progress = document.getElementById('renderProgress');
+    const tagsPlaced = document.getElementById('tagsPlaced');
+    const denseClusters = document.getElementById('denseClusters');
+    const profileLinks = document.getElementById('profileLinks');
+    const pollInterval = 500; // Milliseconds between status checks
+    const maxAttempts = 1200; // Give up after about 10 minutes
+    let attempts = 0;
+
+    function showWarning(message) {
+        if (progress) {
+            progress.className = 'alert alert-warning';
+            progress.textContent = message;
+        }
+    }
+
+    function checkStatus() {
+        attempts += 1;
+        if (attempts > maxAttempts) {
+            showWarning('The full-resolution visualization is taking too long. Please try again later.');
+            return;
+        }
+
+        fetch(statusUrl)
+            .then(response => response.json())
+            .then(status => {
+                if (status.status === 'done') {
+                    loadElementData(status.element_data_url).then(() => {
+                        visualizationImg.src = status.image_url;
+                        if (tagsPlaced) tagsPlaced.textContent = status.tags_placed;
+                        if (denseClusters) showDenseClusters(denseClusters, status);
+                        if (progress) progress.style.display = 'none';
+                        if (profileLinks && status.profile_urls) showProfileLinks(profileLinks, status.profile_urls);
+                    });
+                } else if (status.status === 'pending') {
+                    setTimeout(checkStatus, pollInterval);
+                } else {
+                    showWarning('The full-resolution visualization could not be generated: ' +
+                        (status.error || 'unknown error'));
+                }
+            })
+            .catch(error => {
+                console.warn('Could not check render status:', error);
+                setTimeout(checkStatus, pollInterval * 4);
+            });
+    }
+
+    checkStatus();
+}
+
+function loadElementData(url) {
+    // The full render groups dense clusters, so its element data replaces the preview's
+    if (!url) return Promise.resolve();
+    return fetch(url)
+        .then(response => response.json())
+        .then(data => {
+            if (typeof elementData !== 'undefined') elementData = data;
+        })
+        .catch(error => console.warn('Could not load element data:', error));
+}
+
+function showDenseClusters(item, status) {
+    if (!status.element_groups) {
+        item.style.display = 'none';
+        return;
+    }
+    document.getElementById('groupedElements').textContent = status.grouped_elements;
+    document.getElementById('elementGroups').textContent = status.element_groups;
+    item.style.display = '';
+}
+
+function showProfileLinks(container, profileUrls) {
+    container.textContent = 'Profile: ';
+    for (const [kind, url] of Object.entries(profileUrls)) {
+        const link = document.createElement('a');
+        link.href = url;
+        link.download = '';
+        link.textContent = kind;
+        container.append(link, ' ');
+    }
+}
+
 function setupElementInfoPopup(visualizationImg) {
     // Check if element data is available
     if (typeof elementData === 'undefined') {
@@ -53,6 +141,12 @@ function setupElementInfoPopup(visualizationImg) {
                 margin: 5px 0;
             }
             
+            .element-info-popup .group-members {
+                max-height: 240px;
+                overflow-y: auto;
+                font-size: 12px;
+            }
+            
             .element-info-popup .close-button {
                 position: absolute;
                 top: 5px;
@@ -175,6 +269,11 @@ function setupElementInfoPopup(visualizationImg) {
 
     // Function to show element info popup
     function showElementInfo(element, x, y) {
+        if (element.members) {
+            showGroupInfo(element, x, y);
+            return;
+        }
+
         // Create HTML content for popup
         let html = `
             <h4>Element Details</h4>
@@ -195,8 +294,8 @@ function setupElementInfoPopup(visualizationImg) {
             Y: ${element.min_y.toFixed(4)} to ${element.max_y.toFixed(4)}</p>
         `;
 
-        if (element.is_kit_ds1) {
-            html += `<p><strong>Type:</strong> KIT(DS)1</p>`;
+        if (element.is_labeled) {
+            html += `<p><strong>Labeled:</strong> Yes</p>`;
         }
 
         popupContent.innerHTML = html;
@@ -207,6 +306,33 @@ function setupElementInfoPopup(visualizationImg) {
         popup.style.display = 'block';
     }
 
+    // Function to show the elements of a dense cluster drawn as one marker
+    function showGroupInfo(group, x, y) {
+        let html = `
+            <h4>${group.count} Elements</h4>
+            <p><strong>Coordinates:</strong><br>
+            X: ${group.min_x.toFixed(4)} to ${group.max_x.toFixed(4)}<br>
+            Y: ${group.min_y.toFixed(4)} to ${group.max_y.toFixed(4)}</p>
+            <div class="group-members">
+        `;
+
+        for (const member of group.members) {
+            html += `<p><strong>${member.id}</strong>`;
+            if (member.family) {
+                html += ` ${member.family}`;
+            }
+            html += `<br>X: ${member.min_x.toFixed(4)} to ${member.max_x.toFixed(4)},
+                Y: ${member.min_y.toFixed(4)} to ${member.max_y.toFixed(4)}</p>`;
+        }
+
+        popupContent.innerHTML = html + '</div>';
+
+        // Position the popup
+        popup.style.left = (x + 10) + 'px';
+        popup.style.top = (y + 10) + 'px';
+        popup.style.display = 'block';
+    }
+
     // Hide popup when clicking outside
     document.addEventListener('click', function(e) {
         if (e.target !== visualizationImg && !popup.contains(e.target)) {
@@ -0,0 +1,318 @@
+# visualizer/tests.py
+import csv
+import gzip
+import io
+import json
+import math
+import random
+from itertools import count
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from .export import PLACEMENT_FIELDS, iter_placement_lines, placement_row
+from .families import GRAY, HIDE, LABEL, FamilyIndex, FamilyRuleError, FamilySelection
+from .lod import cluster_elements
+from .memory import AdmissionError, BYTES_PER_ELEMENT_JSON, estimate_peak_memory, plan_admission
+from .uploads import InflatedSizeExceeded, UploadError, open_upload
+from .utils import (
+    Element, ElementGroup, OccupancyPyramid, Tag, iter_json_array, place_tags_grid_snapping
+)
+from .views import _accept_quality
+
+
+def exhaustive_best_cell(grid, center_row, center_col, radius, score, lower_bound=None):
+    """Reference for OccupancyPyramid.find_best_cell that scores every free cell in the window"""
+    best = None
+    for row in range(max(0, center_row - radius), min(grid.rows - 1, center_row + radius) + 1):
+        for col in range(max(0, center_col - radius), min(grid.cols - 1, center_col + radius) + 1):
+            if grid.is_free(row, col):
+                candidate = (score(row - center_row, col - center_col), row, col)
+                best = min(best or candidate, candidate)
+    return best[1:] if best else None
+
+
+def placement_score(aligned_rows, center_row):
+    """Score of place_tags_grid_snapping with the rows in aligned_rows getting the alignment bonus"""
+    def score(r, c):
+        horizontal_bias = 0.7 if abs(r) < abs(c) else 1.0
+        alignment_bonus = 0.5 if center_row + r in aligned_rows else 0.0
+        return math.sqrt(r * r + c * c) * horizontal_bias - alignment_bonus
+    return score
+
+
+def make_element(element_id, x, y, size, family_name='KIT(DS)1'):
+    element = Element({
+        'id': element_id,
+        'coordinates': {
+            'family_name': family_name,
+            'min': {'x': x - size / 2, 'y': y - size / 2},
+            'center': {'x': x, 'y': y},
+            'max': {'x': x + size / 2, 'y': y + size / 2},
+        },
+    })
+    element.is_labeled = family_name == 'KIT(DS)1'
+    return element
+
+
+class OccupancyPyramidTests(SimpleTestCase):
+    """The pyramid search must find the same cell as scoring every cell of the window"""
+
+    def test_matches_exhaustive_search_on_random_grids(self):
+        rng = random.Random(39)
+        for _ in range(200):
+            rows, cols = rng.randint(1, 40), rng.randint(1, 40)
+            occupied = np.array([[rng.random() < 0.8 for _ in range(cols)] for _ in range(rows)])
+            grid = OccupancyPyramid(occupied)
+
+            center_row, center_col = rng.randrange(rows), rng.randrange(cols)
+            radius = rng.randint(0, 25)
+            aligned_rows = {rng.randrange(rows) for _ in range(rng.randint(0, 5))}
+            score = placement_score(aligned_rows, center_row)
+            lower_bound = lambda distance: distance * 0.7 - 0.5  # noqa: E731
+
+            self.assertEqual(
+                grid.find_best_cell(center_row, center_col, radius, score, lower_bound),
+                exhaustive_best_cell(grid, center_row, center_col, radius, score),
+            )
+
+    def test_matches_exhaustive_search_while_occupying(self):
+        rng = random.Random(7)
+        occupied = np.array([[rng.random() < 0.5 for _ in range(33)] for _ in range(27)])
+        grid = OccupancyPyramid(occupied)
+        score = placement_score(set(), 0)
+        lower_bound = lambda distance: distance * 0.7  # noqa: E731
+
+        # Occupy the best cell each time, as placement does, until the grid is full
+        while True:
+            center_row, center_col = rng.randrange(grid.rows), rng.randrange(grid.cols)
+            best = grid.find_best_cell(center_row, center_col, 40, score, lower_bound)
+            self.assertEqual(best, exhaustive_best_cell(grid, center_row, center_col, 40, score))
+            if best is None:
+                break
+            grid.occupy(*best)
+
+        self.assertFalse(grid.levels[-1].any())
+
+
+class TagPlacementTests(SimpleTestCase):
+
+    def test_same_placement_as_exhaustive_search(self):
+        # place_tags_grid_snapping picks one cell size for the whole grid, so with the
+        # same elements both searches work on the same cells
+        rng = random.Random(3)
+        kit_elements = [
+            make_element(i, rng.choice([0, 500]) + rng.uniform(0, 20), rng.uniform(0, 10), 0.2)
+            for i in range(150)
+        ]
+        other_elements = [
+            make_element(1000 + i, rng.uniform(0, 520), rng.uniform(0, 10), 0.5, 'Other')
+            for i in range(50)
+        ]
+
+        def positions():
+            return [(tag.x, tag.y) for tag in place_tags_grid_snapping(kit_elements, other_elements, 12)]
+
+        pyramid_positions = positions()
+        with mock.patch.object(OccupancyPyramid, 'find_best_cell', exhaustive_best_cell):
+            exhaustive_positions = positions()
+
+        self.assertEqual(pyramid_positions, exhaustive_positions)
+
+
+class CountingStringIO(io.StringIO):
+    """StringIO recording how many characters were read"""
+
+    def __init__(self, value):
+        super().__init__(value)
+        self.chars_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.chars_read += len(data)
+        return data
+
+
+class IterJsonArrayTests(SimpleTestCase):
+
+    def test_items_split_across_chunks(self):
+        items = [
+            {'id': 1, 'coordinates': {'min': {'x': 1.5, 'y': -2e3}}},
+            12345678, -0.25, 'a "quoted" \\ string', [1, [2, []]], True, None, {},
+        ]
+        text = ' [ ' + ' ,\n '.join(json.dumps(item) for item in items) + ' ] '
+        for chunk_size in range(1, 12):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(list(iter_json_array(io.StringIO(text), chunk_size=chunk_size)), items)
+
+    def test_empty_array(self):
+        self.assertEqual(list(iter_json_array(io.StringIO(' [ \n ] '), chunk_size=1)), [])
+
+    def test_not_an_array(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array(io.StringIO('{"id": 1}')))
+
+    def test_truncated_array(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array(io.StringIO('[{"id": 1}, {"id": 2'), chunk_size=4))
+
+    def test_malformed_item_stops_at_max_item_size(self):
+        stream = CountingStringIO('[{"id": 1}, {"id": tru, "pad": "' + 'x' * 100000 + '"}]')
+        with self.assertRaises(ValueError):
+            list(iter_json_array(stream, chunk_size=16, max_item_size=100))
+        self.assertLess(stream.chars_read, 200)
+
+
+class OpenUploadTests(SimpleTestCase):
+
+    def test_gzip_within_limit(self):
+        data = b'[' + b','.join(b'{"id": %d}' % i for i in range(1000)) + b']'
+        stream = open_upload(io.BytesIO(gzip.compress(data)), 'plan.json.gz', max_inflated_size=len(data))
+        self.assertEqual(stream.read(), data.decode())
+
+    def test_inflate_limit(self):
+        data = b'[' + b' ' * 100000 + b']'
+        for name, content_encoding in (('plan.json.gz', None), (None, 'gzip')):
+            with self.subTest(name=name, content_encoding=content_encoding):
+                stream = open_upload(io.BytesIO(gzip.compress(data)), name, content_encoding, max_inflated_size=1000)
+                with self.assertRaises(InflatedSizeExceeded):
+                    stream.read()
+
+    def test_unsupported_content_encoding(self):
+        with self.assertRaises(UploadError):
+            open_upload(io.BytesIO(b'[]'), content_encoding='br')
+
+
+class AcceptQualityTests(SimpleTestCase):
+
+    def test_quality(self):
+        cases = [
+            ('image/webp', 1.0),
+            ('image/webp;q=0', 0.0),
+            ('image/png, image/webp; q=0.5', 0.5),
+            ('image/*;q=0.8', 0.8),
+            ('*/*;q=0.1', 0.1),
+            ('image/*;q=0.9, image/webp;q=0', 0.0),
+            ('text/html', 0.0),
+            ('IMAGE/WEBP;Q=0.3', 0.3),
+            ('image/webp;q=high', 0.0),
+        ]
+        for accept, quality in cases:
+            with self.subTest(accept=accept):
+                self.assertEqual(_accept_quality(accept, 'image/webp'), quality)
+
+
+class PlanAdmissionTests(SimpleTestCase):
+    element_count = 10000
+    inflated_size = element_count * BYTES_PER_ELEMENT_JSON
+
+    def test_fits(self):
+        estimate = estimate_peak_memory(self.element_count, self.element_count, 150)
+        self.assertEqual(plan_admission(self.inflated_size, 150, estimate), (estimate, 150, None))
+
+    def test_lowers_dpi_first(self):
+        budget = estimate_peak_memory(self.element_count, self.element_count, 100)
+        self.assertEqual(plan_admission(self.inflated_size, 150, budget), (budget, 100, None))
+
+    def test_labels_first_elements_at_min_dpi(self):
+        budget = estimate_peak_memory(self.element_count, 2000, 72)
+        estimate, dpi, max_labels = plan_admission(self.inflated_size, 150, budget, min_dpi=72, min_labels=500)
+        self.assertEqual((dpi, max_labels), (72, 2000))
+        self.assertLessEqual(estimate, budget)
+
+    def test_keeps_min_dpi(self):
+        budget = estimate_peak_memory(self.element_count, 2000, 100)
+        _, dpi, max_labels = plan_admission(self.inflated_size, 150, budget, min_dpi=100, min_labels=500)
+        self.assertEqual((dpi, max_labels), (100, 2000))
+
+    def test_rejects_when_too_few_labels_fit(self):
+        budget = estimate_peak_memory(self.element_count, 100, 72)
+        with self.assertRaises(AdmissionError):
+            plan_admission(self.inflated_size, 150, budget, min_dpi=72, min_labels=500)
+
+
+class FamilySelectionTests(SimpleTestCase):
+
+    def test_role(self):
+        selection = FamilySelection(label=['KIT*', 're:Door'], gray=['*'], hide=['KIT_Hidden'])
+        self.assertEqual(selection.role('KIT(DS)1'), LABEL)
+        self.assertEqual(selection.role('Front Door'), LABEL)
+        self.assertEqual(selection.role('KIT_Hidden'), HIDE)
+        self.assertEqual(selection.role('Window'), GRAY)
+        self.assertEqual(selection.role(None), GRAY)
+
+    def test_default(self):
+        self.assertEqual(FamilySelection.default().role('Socket KIT(DS)1'), LABEL)
+        self.assertEqual(FamilySelection.default().role('Window'), HIDE)
+        self.assertEqual(FamilySelection.default(show_other_families=True).role('Window'), GRAY)
+
+    def test_invalid_regex(self):
+        with self.assertRaises(FamilyRuleError):
+            FamilySelection(label=['re:('])
+
+    def test_split_keeps_order_and_marks_labeled(self):
+        families = ['KIT(DS)1', 'Window', 'KIT(DS)1', 'Door', 'Window', None]
+        elements = [make_element(i, i, 0, 1, family) for i, family in enumerate(families)]
+        index = FamilyIndex(elements)
+
+        labeled, gray = index.split(FamilySelection(gray=['Window', 'Door']))
+        self.assertEqual([e.id for e in labeled], [0, 2])
+        self.assertEqual([e.id for e in gray], [1, 3, 4])
+        self.assertEqual([e.is_labeled for e in elements], [True, False, True, False, False, False])
+
+        # A new selection resets the elements labeled before
+        labeled, gray = index.split(FamilySelection(label=['Door']))
+        self.assertEqual([e.id for e in labeled], [3])
+        self.assertEqual(gray, [])
+        self.assertEqual([e.is_labeled for e in elements], [False, False, False, True, False, False])
+
+
+class ClusterElementsTests(SimpleTestCase):
+
+    def test_groups_small_elements_sharing_a_cell(self):
+        elements = [
+            make_element(0, 0.2, 0.2, 0.1),
+            make_element(1, 5.5, 5.5, 3),  # Larger than a cell
+            make_element(2, 0.7, 0.4, 0.1),
+            make_element(3, 3.5, 0.5, 0.1),  # Alone in its cell
+            make_element(4, 0.5, 0.9, 0.1),
+        ]
+        result = cluster_elements(elements, 1.0, count(1))
+
+        self.assertEqual(len(result), 3)
+        group = result[0]
+        self.assertIsInstance(group, ElementGroup)
+        self.assertEqual([e.id for e in group.members], [0, 2, 4])
+        self.assertEqual(group.tag_text, '×3')
+        self.assertIs(result[1], elements[1])
+        self.assertIs(result[2], elements[3])
+
+    def test_nothing_to_group(self):
+        elements = [make_element(i, i * 2.0, 0, 0.1) for i in range(4)]
+        self.assertIs(cluster_elements(elements, 1.0, count(1)), elements)
+
+
+class IterPlacementLinesTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tags = []
+        for i, family in enumerate(['KIT(DS)1', 'Door, "front"']):
+            tag = Tag(make_element(100 + i, i, i, 0.5, family))
+            tag.x, tag.y = i + 1.5, i - 0.5
+            self.tags.append(tag)
+
+    def test_jsonl(self):
+        lines = list(iter_placement_lines(self.tags, 'jsonl'))
+        self.assertEqual([json.loads(line) for line in lines], [placement_row(tag) for tag in self.tags])
+        self.assertTrue(all(line.endswith('\n') for line in lines))
+
+    def test_csv(self):
+        rows = list(csv.reader(io.StringIO(''.join(iter_placement_lines(self.tags, 'csv')))))
+        self.assertEqual(rows[0], list(PLACEMENT_FIELDS))
+        self.assertEqual([row[:3] for row in rows[1:]], [['100', 'KIT(DS)1', '100'], ['101', 'Door, "front"', '101']])
+        self.assertEqual(float(rows[1][PLACEMENT_FIELDS.index('line_end_x')]), self.tags[0].x + self.tags[0].width / 2)
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            list(iter_placement_lines(self.tags, 'xml'))
@@ -0,0 +1,109 @@
+# visualizer/uploads.py
+import gzip
+import io
+
+try:
+    import zstandard
+except ImportError:  # zstd support is optional
+    zstandard = None
+
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# Upload file name suffixes mapped to their compression
+COMPRESSED_SUFFIXES = {
+    '.gz': 'gzip',
+    '.zst': 'zstd',
+}
+
+
+class UploadError(ValueError):
+    """Raised when an uploaded file cannot be decoded"""
+
+
+class InflatedSizeExceeded(UploadError):
+    """Raised when a (decompressed) upload grows past the configured limit"""
+
+
+class LimitedReader(io.RawIOBase):
+    """Binary stream wrapper that refuses to read more than max_size bytes"""
+
+    def __init__(self, stream, max_size=None):
+        self._stream = stream
+        self.max_size = max_size
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._stream.read(len(buffer))
+        if not data:
+            return 0
+
+        self.bytes_read += len(data)
+        if self.max_size is not None and self.bytes_read > self.max_size:
+            raise InflatedSizeExceeded(
+                f'Uploaded data exceeds the limit of {self.max_size} bytes when decompressed.'
+            )
+
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def detect_compression(fileobj, name=None, content_encoding=None):
+    """Returns 'gzip', 'zstd' or None for the given upload"""
+    if content_encoding:
+        encoding = content_encoding.strip().lower()
+        if encoding in ('gzip', 'x-gzip'):
+            return 'gzip'
+        if encoding == 'zstd':
+            return 'zstd'
+        if encoding != 'identity':
+            raise UploadError(f'Unsupported Content-Encoding: {content_encoding}')
+        return None
+
+    if name:
+        for suffix, compression in COMPRESSED_SUFFIXES.items():
+            if name.lower().endswith(suffix):
+                return compression
+
+    # Fall back to sniffing magic bytes when the stream can be rewound
+    if getattr(fileobj, 'seekable', lambda: False)():
+        head = fileobj.read(4)
+        fileobj.seek(0)
+        if head.startswith(GZIP_MAGIC):
+            return 'gzip'
+        if head.startswith(ZSTD_MAGIC):
+            return 'zstd'
+
+    return None
+
+
+def open_upload(fileobj, name=None, content_encoding=None, max_inflated_size=None):
+    """
+    Open an uploaded file as a text stream, decompressing it on the fly
+
+    Args:
+        fileobj: Binary file-like object (uploaded file or request body)
+        name: Optional file name used to detect compression
+        content_encoding: Optional Content-Encoding header value
+        max_inflated_size: Maximum number of bytes to read after decompression
+
+    Returns:
+        A UTF-8 text stream over the (decompressed) data
+    """
+    compression = detect_compression(fileobj, name, content_encoding)
+
+    if compression == 'gzip':
+        raw = gzip.GzipFile(fileobj=fileobj, mode='rb')
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise UploadError('Zstandard uploads require the "zstandard" package.')
+        raw = zstandard.ZstdDecompressor().stream_reader(fileobj)
+    else:
+        raw = fileobj
+
+    limited = io.BufferedReader(LimitedReader(raw, max_inflated_size))
+    return io.TextIOWrapper(limited, encoding='utf-8')
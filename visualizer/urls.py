@@ -1,4 +1,5 @@
 # visualizer/urls.py
+from django.conf import settings
 from django.urls import path
 from . import views
 
@@ -6,5 +7,11 @@ app_name = 'visualizer'
 
 urlpatterns = [
     path('', views.index, name='index'),
-    path('visualize/', views.visualize, name='visualize'),
-]
\ No newline at end of file
+    path(
+        'visualize/',
+        views.visualize_async if settings.VISUALIZER_ASYNC_VIEW else views.visualize,
+        name='visualize'
+    ),
+    path('visualize/status/<uuid:job_id>/', views.render_status, name='render_status'),
+    path('placements/', views.placements, name='placements'),
+]
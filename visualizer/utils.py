@@ -1,14 +1,25 @@
 # visualizer/utils.py
 import io
 import base64
+import heapq
 import json
 import math
+import re
+import sys
+import threading
+from collections import Counter, OrderedDict
 
+import numpy as np
 import matplotlib.pyplot as plt
-import matplotlib.patches as patches
+import matplotlib.ticker as ticker
 
 from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+from matplotlib.collections import LineCollection, PolyCollection
+from matplotlib.colors import to_rgba
 from matplotlib.figure import Figure
+from PIL import Image
+
+from .uploads import UploadError
 
 
 class Element:
@@ -16,7 +27,9 @@ class Element:
 
     def __init__(self, data):
         self.id = data.get('id')
-        self.family_name = data.get('coordinates', {}).get('family_name')
+        family_name = data.get('coordinates', {}).get('family_name')
+        # Interned, so elements of a family share one string and index lookups compare by identity
+        self.family_name = sys.intern(family_name) if isinstance(family_name, str) else family_name
         self.min_x = data.get('coordinates', {}).get('min', {}).get('x')
         self.min_y = data.get('coordinates', {}).get('min', {}).get('y')
         self.max_x = data.get('coordinates', {}).get('max', {}).get('x')
@@ -24,7 +37,8 @@ class Element:
         self.center_x = data.get('coordinates', {}).get('center', {}).get('x')
         self.center_y = data.get('coordinates', {}).get('center', {}).get('y')
         self.document = data.get('document')
-        self.is_kit_ds1 = 'KIT(DS)1' in self.family_name if self.family_name else False
+        # Set for elements of the families selected for labeling, see FamilyIndex.split
+        self.is_labeled = False
 
     @property
     def width(self):
@@ -44,9 +58,42 @@ class Element:
         """Returns (center_x, center_y)"""
         return (self.center_x, self.center_y)
 
+    @property
+    def tag_text(self):
+        """Text of the element's tag"""
+        return f"{self.id}"
+
     def get_color(self):
         """Returns color based on element type"""
-        return '#3498db' if self.is_kit_ds1 else '#cccccc'
+        return '#3498db' if self.is_labeled else '#cccccc'
+
+
+class ElementGroup(Element):
+    """Aggregate marker standing in for a dense cluster of elements, see lod.py"""
+
+    def __init__(self, group_id, members):
+        self.id = group_id
+        self.members = members
+        families = {element.family_name for element in members}
+        self.family_name = families.pop() if len(families) == 1 else None
+        self.min_x = min(element.min_x for element in members)
+        self.min_y = min(element.min_y for element in members)
+        self.max_x = max(element.max_x for element in members)
+        self.max_y = max(element.max_y for element in members)
+        self.center_x = (self.min_x + self.max_x) / 2
+        self.center_y = (self.min_y + self.max_y) / 2
+        self.document = members[0].document
+        # Members of a group share their role, as labeled and gray elements are grouped separately
+        self.is_labeled = members[0].is_labeled
+
+    @property
+    def tag_text(self):
+        """A group's tag shows the number of elements it stands for"""
+        return f"×{len(self.members)}"
+
+    def get_color(self):
+        """Returns a darker shade of the members' color"""
+        return '#1f618d' if self.is_labeled else '#999999'
 
 
 class Tag:
@@ -56,7 +103,7 @@ class Tag:
         self.element = element
 
         # Use ID as the tag text
-        self.text = text or f"{element.id}"
+        self.text = text or element.tag_text
         self.tag_size = tag_size
 
         # Default position (will be optimized later)
@@ -72,7 +119,7 @@ class Tag:
         self.height = 0.6  # Increased for better text visibility
 
         # The actual size constraints will be applied after view area is known
-        # in place_tags_grid_snapping and generate_visualization
+        # in place_tags_grid_snapping and render_image
 
         # Connection line start point (to element)
         self.line_start_x = element.center_x
@@ -187,18 +234,103 @@ class Tag:
         return (self.x, self.y, self.x + self.width, self.y + self.height)
 
 
-def parse_json_data(file_content):
-    """Parse JSON data and create Element objects"""
+# Largest array item iter_json_array buffers while waiting for the rest of it
+MAX_JSON_ITEM_SIZE = 1024 * 1024
+
+# Characters that may continue a decoded number, and a buffer tail made only of them
+_NUMBER_CHARS = frozenset('0123456789.eE+-')
+_NUMBER_TAIL = re.compile(r'[0-9.eE+-]*\Z')
+
+
+def iter_json_array(stream, chunk_size=64 * 1024, max_item_size=MAX_JSON_ITEM_SIZE):
+    """
+    Yield the items of a top-level JSON array read incrementally from a text stream
+
+    Only one chunk plus the item being decoded is held in memory at a time,
+    so large (or decompressed) uploads never have to be inflated into a single string.
+    An item that still fails to decode once max_item_size characters of it are
+    buffered is malformed, and the error is raised without reading further.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    exhausted = False
+
+    def fill():
+        nonlocal buffer, pos, exhausted
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            exhausted = True
+            return False
+        # Drop the consumed part of the buffer before appending new data
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        return True
+
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+                pos += 1
+            if pos < len(buffer) or not fill():
+                return
+
+    skip_whitespace()
+    if pos >= len(buffer) or buffer[pos] != '[':
+        raise ValueError('Expected a JSON array of elements')
+    pos += 1
+
+    skip_whitespace()
+    if pos < len(buffer) and buffer[pos] == ']':
+        return
+
+    while True:
+        skip_whitespace()
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # The item is split across chunks - read more and retry, unless
+            # more than any element's worth of data is already pending
+            if exhausted or len(buffer) - pos > max_item_size or not fill():
+                raise
+            continue
+
+        # A number may continue in the next chunk, also after what was decoded
+        # ('1' of '1.5', '-0' of '-0.25' when the buffer ends with '-0.')
+        if (not exhausted and (end == len(buffer) or buffer[end] in _NUMBER_CHARS)
+                and _NUMBER_TAIL.match(buffer, end) and fill()):
+            continue
+
+        pos = end
+        yield item
+
+        skip_whitespace()
+        if pos >= len(buffer):
+            raise ValueError('Unexpected end of JSON array')
+        if buffer[pos] == ']':
+            return
+        if buffer[pos] != ',':
+            raise ValueError(f"Expected ',' or ']' at position {pos}")
+        pos += 1
+
+
+def parse_json_stream(stream):
+    """Parse JSON data from a text stream and create Element objects"""
     try:
-        data = json.loads(file_content)
-        elements = [Element(item) for item in data]
-        return elements
+        return [Element(item) for item in iter_json_array(stream)]
+    except UploadError:
+        raise
     except Exception as e:
         # Handle parsing errors
         print(f"Error parsing JSON: {e}")
         return []
 
 
+def parse_json_data(file_content):
+    """Parse JSON data and create Element objects"""
+    return parse_json_stream(io.StringIO(file_content))
+
+
 def align_tags_in_groups(tags, proximity_threshold=50):
     """Aligns tags in horizontal or vertical groups based on proximity"""
     # Find horizontal groups (similar y-coordinates)
@@ -237,12 +369,130 @@ def align_tags_in_groups(tags, proximity_threshold=50):
     return tags
 
 
+class OccupancyPyramid:
+    """
+    Grid of occupied cells with coarser levels for the tag position search
+
+    Each cell of a level covers 2x2 cells of the level below and is free when any of
+    them is free (the levels store the number of free cells below, so occupying a
+    cell only updates one cell per level). find_best_cell searches from the coarsest
+    level down, skipping fully occupied blocks and blocks too far away to beat the
+    best cell found, so its cost depends on how close the free space is rather than
+    on the size of the search window.
+    """
+
+    def __init__(self, occupied):
+        """
+        Args:
+            occupied: Boolean array of shape (rows, columns), True for occupied cells
+        """
+        self.rows, self.cols = occupied.shape
+        free = (~occupied).astype(np.int32)
+        self.levels = [free]
+        while free.shape[0] > 1 or free.shape[1] > 1:
+            rows, cols = free.shape
+            padded = np.zeros((rows + rows % 2, cols + cols % 2), dtype=np.int32)
+            padded[:rows, :cols] = free
+            free = padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2).sum(axis=(1, 3))
+            self.levels.append(free)
+
+    def is_free(self, row, col):
+        return self.levels[0][row, col] > 0
+
+    def occupy(self, row, col):
+        """Mark a cell as occupied"""
+        if not self.is_free(row, col):
+            return
+        for level in self.levels:
+            level[row, col] -= 1
+            row, col = row // 2, col // 2
+
+    def find_best_cell(self, center_row, center_col, radius, score, lower_bound):
+        """
+        Find the free cell with the lowest score within radius rows and columns of a cell
+
+        Args:
+            center_row, center_col: Cell to search around
+            radius: Largest row and column offset searched
+            score: Function of the (row, column) offset of a free cell returning its score
+            lower_bound: Function of a distance in cells returning a score that no cell
+                at that distance or further can beat
+
+        Returns:
+            (row, col) of the best cell, the first in row-major order on ties, or None
+        """
+        row_min, row_max = max(0, center_row - radius), min(self.rows - 1, center_row + radius)
+        col_min, col_max = max(0, center_col - radius), min(self.cols - 1, center_col + radius)
+        top = len(self.levels) - 1
+        if row_min > row_max or col_min > col_max or not self.levels[top][0, 0]:
+            return None
+
+        # Blocks keyed by the lower bound of their cells' scores, cells by their score
+        heap = [(lower_bound(0), top, 0, 0)]
+        best = None
+        while heap and (best is None or heap[0][0] <= best[0]):
+            key, level, row, col = heapq.heappop(heap)
+            if level == 0:
+                best = min(best or (key, row, col), (key, row, col))
+                continue
+
+            size = 1 << (level - 1)
+            below = self.levels[level - 1]
+            for child_row in (2 * row, 2 * row + 1):
+                first_row = max(child_row * size, row_min)
+                last_row = min((child_row + 1) * size - 1, row_max)
+                if first_row > last_row:
+                    continue
+                for child_col in (2 * col, 2 * col + 1):
+                    first_col = max(child_col * size, col_min)
+                    last_col = min((child_col + 1) * size - 1, col_max)
+                    if first_col > last_col or not below[child_row, child_col]:
+                        continue
+
+                    if level == 1:
+                        child_key = score(child_row - center_row, child_col - center_col)
+                    else:
+                        # Distance from the center to the nearest cell of the block within the window
+                        dr = max(0, first_row - center_row, center_row - last_row)
+                        dc = max(0, first_col - center_col, center_col - last_col)
+                        child_key = lower_bound(math.sqrt(dr * dr + dc * dc))
+                    heapq.heappush(heap, (child_key, level - 1, child_row, child_col))
+
+        return best[1:] if best else None
+
+
+def _local_element_spacing(elements, min_x, min_y, view_width, view_height, bins=40):
+    """
+    Typical distance between neighboring elements in the regions that have elements
+
+    Element centers are counted in a bins x bins histogram of the view, and the density
+    of each bin is weighted by its number of elements, so that the empty space of sparse
+    or clustered layouts does not make the elements look further apart than they are.
+    """
+    if view_width <= 0 or view_height <= 0:
+        return math.inf
+
+    centers = np.array([((e.min_x + e.max_x) / 2, (e.min_y + e.max_y) / 2) for e in elements])
+    counts, _, _ = np.histogram2d(
+        centers[:, 0], centers[:, 1], bins=bins,
+        range=[[min_x, min_x + view_width], [min_y, min_y + view_height]]
+    )
+    bin_area = (view_width / bins) * (view_height / bins)
+    density = (counts ** 2).sum() / counts.sum() / bin_area
+    return 1 / math.sqrt(density)
+
+
+def _nearest_row(y, min_y, cell_height):
+    """Index of the grid row within half a cell of y"""
+    return math.floor((y - min_y) / cell_height + 0.5)
+
+
 def place_tags_grid_snapping(kit_elements, other_elements=None, tag_size=8):
     """
     Place tags using a grid snapping approach
 
     Args:
-        kit_elements: List of Element objects from KIT(DS)1 family
+        kit_elements: List of Element objects to label (KIT(DS)1 family by default)
         other_elements: Optional list of other Element objects
         tag_size: Size of the tags
 
@@ -281,7 +531,7 @@ def place_tags_grid_snapping(kit_elements, other_elements=None, tag_size=8):
 
             # For single elements, ensure appropriate view dimensions for constraints
             if len(all_elements) == 1:
-                # Approximate the expected view area (similar to generate_visualization)
+                # Approximate the expected view area (similar to compute_view_layout)
                 expected_view_width = 3  # About 3 units for 1705-1708
                 expected_view_height = 3  # About 3 units for 100-103
 
@@ -331,18 +581,27 @@ def place_tags_grid_snapping(kit_elements, other_elements=None, tag_size=8):
     # For multiple elements scenario like in the test JSON
     grid_density = 40  # Increased for even finer grid (was 30)
 
-    # Calculate cell dimensions based on view size and desired density
+    # Calculate cell dimensions based on view size and local element density
     # We want cells that are small enough for precise placement but
-    # large enough to fit tags
-    grid_cell_width = max(view_width / grid_density, avg_tag_width * 0.7)
-    grid_cell_height = max(view_height / grid_density, avg_tag_height * 0.7)
+    # large enough to fit tags, and finer than 1/grid_density of the view
+    # where elements are packed more closely than that
+    spacing = _local_element_spacing(all_elements, min_x, min_y, view_width, view_height, grid_density)
+    grid_cell_width = max(min(view_width / grid_density, spacing), avg_tag_width * 0.7)
+    grid_cell_height = max(min(view_height / grid_density, spacing), avg_tag_height * 0.7)
+
+    # Keep the grid within a fixed number of cells on huge views with tiny tags
+    max_grid_cells = 1000000
+    scale = math.sqrt(view_width * view_height / (grid_cell_width * grid_cell_height) / max_grid_cells)
+    if scale > 1:
+        grid_cell_width *= scale
+        grid_cell_height *= scale
 
     # Calculate grid dimensions
     grid_width = max(15, int(view_width / grid_cell_width) + 2)  # Increased minimum size
     grid_height = max(15, int(view_height / grid_cell_height) + 2)  # Increased minimum size
 
     # Create grid to track occupied cells
-    grid = [[False for _ in range(grid_width)] for _ in range(grid_height)]
+    occupied = np.zeros((grid_height, grid_width), dtype=bool)
 
     # Mark cells occupied by elements with a larger margin
     for element in all_elements:
@@ -354,10 +613,15 @@ def place_tags_grid_snapping(kit_elements, other_elements=None, tag_size=8):
         start_row = max(0, int((element.min_y - safety_margin - min_y) / grid_cell_height))
         end_row = min(grid_height - 1, int((element.max_y + safety_margin - min_y) / grid_cell_height) + 1)
 
-        for row in range(start_row, end_row + 1):
-            for col in range(start_col, end_col + 1):
-                if 0 <= row < grid_height and 0 <= col < grid_width:
-                    grid[row][col] = True
+        occupied[start_row:end_row + 1, start_col:end_col + 1] = True
+
+    grid = OccupancyPyramid(occupied)
+
+    # Number of tags whose y lies within half a cell of each grid row, for the alignment bonus
+    aligned_rows = Counter(_nearest_row(tag.y, min_y, grid_cell_height) for tag in tags)
+
+    # For multiple elements, increase the search radius to find better tag positions
+    search_radius = max(10, min(grid_width, grid_height) // 2)  # Increased from 8 to 10
 
     # Place tags in unoccupied cells close to their elements
     for tag in tags:
@@ -365,44 +629,29 @@ def place_tags_grid_snapping(kit_elements, other_elements=None, tag_size=8):
         center_col = int((element.center_x - min_x) / grid_cell_width)
         center_row = int((element.center_y - min_y) / grid_cell_height)
 
-        # Try to find the best position based on scoring
-        best_cell = None
-        min_distance = float('inf')
-
-        # For multiple elements, increase the search radius to find better tag positions
-        search_radius = max(10, min(grid_width, grid_height) // 2)  # Increased from 8 to 10
-
-        # Score possible positions instead of just using distance
-        for r in range(-search_radius, search_radius + 1):
-            for c in range(-search_radius, search_radius + 1):
-                row, col = center_row + r, center_col + c
-
-                # Check if cell is within grid and unoccupied
-                if (0 <= row < grid_height and 0 <= col < grid_width and not grid[row][col]):
-                    # Calculate position score based on multiple factors
-                    # Euclidean distance (lower is better)
-                    distance = math.sqrt(r * r + c * c)
-
-                    # Prefer positions to the right or left of the element
-                    # rather than above/below for better readability
-                    horizontal_bias = 0.7 if abs(r) < abs(c) else 1.0
-
-                    # Prefer positions that align with existing tags
-                    alignment_bonus = 0.0
-                    for existing_tag in tags:
-                        if tag != existing_tag:
-                            exist_y = existing_tag.y
-                            potential_y = min_y + row * grid_cell_height
-                            if abs(exist_y - potential_y) < grid_cell_height / 2:
-                                alignment_bonus = 0.5  # Bonus for horizontal alignment
-                                break
-
-                    # Calculate final score (lower is better)
-                    score = distance * horizontal_bias - alignment_bonus
-
-                    if score < min_distance:
-                        min_distance = score
-                        best_cell = (row, col)
+        # Prefer positions that align with other tags, but not with the tag itself
+        aligned_rows[_nearest_row(tag.y, min_y, grid_cell_height)] -= 1
+
+        def score(r, c):
+            """Score of the free cell at an offset from the element (lower is better)"""
+            # Euclidean distance (lower is better)
+            distance = math.sqrt(r * r + c * c)
+
+            # Prefer positions to the right or left of the element
+            # rather than above/below for better readability
+            horizontal_bias = 0.7 if abs(r) < abs(c) else 1.0
+
+            # Bonus for horizontal alignment with existing tags
+            alignment_bonus = 0.5 if aligned_rows[center_row + r] > 0 else 0.0
+
+            return distance * horizontal_bias - alignment_bonus
+
+        # Try to find the best position based on scoring; no cell at a distance
+        # can score better than with the horizontal bias and alignment bonus
+        best_cell = grid.find_best_cell(
+            center_row, center_col, search_radius, score,
+            lower_bound=lambda distance: distance * 0.7 - 0.5
+        )
 
         # Use the best cell or default to element center if none found
         if best_cell:
@@ -412,7 +661,7 @@ def place_tags_grid_snapping(kit_elements, other_elements=None, tag_size=8):
 
             # Mark this cell as occupied
             row, col = best_cell
-            grid[row][col] = True
+            grid.occupy(row, col)
 
             # Keep track of the line that connects tag to element
             tag.line_start_x = element.center_x
@@ -424,6 +673,8 @@ def place_tags_grid_snapping(kit_elements, other_elements=None, tag_size=8):
             tag.x = element.center_x + offset
             tag.y = element.center_y + offset
 
+        aligned_rows[_nearest_row(tag.y, min_y, grid_cell_height)] += 1
+
     # Resolve remaining overlaps if any
     max_adjustment_attempts = 5  # Increased from 3 to 5
     for _ in range(max_adjustment_attempts):
@@ -507,48 +758,54 @@ def place_tags_grid_snapping(kit_elements, other_elements=None, tag_size=8):
     return tags
 
 
+def _element_data(element):
+    """Returns the details of an element shown when it is clicked"""
+    return {
+        'id': element.id,
+        'family': element.family_name or '',
+        'document': element.document or '',
+        'min_x': element.min_x,
+        'min_y': element.min_y,
+        'max_x': element.max_x,
+        'max_y': element.max_y,
+        'is_labeled': element.is_labeled
+    }
+
+
 def create_element_data_json(kit_elements, other_elements=None):
-    """Create a JSON string with element data for JavaScript interaction"""
+    """
+    Create a JSON string with element data for JavaScript interaction
+
+    Element groups are listed with their count and the details of each member.
+    """
     all_elements = kit_elements + (other_elements or [])
     element_data = {}
 
     for element in all_elements:
-        element_data[str(element.id)] = {
-            'id': element.id,
-            'family': element.family_name or '',
-            'document': element.document or '',
-            'min_x': element.min_x,
-            'min_y': element.min_y,
-            'max_x': element.max_x,
-            'max_y': element.max_y,
-            'is_kit_ds1': element.is_kit_ds1
-        }
+        data = _element_data(element)
+        if isinstance(element, ElementGroup):
+            data['count'] = len(element.members)
+            data['members'] = [_element_data(member) for member in element.members]
+        element_data[str(element.id)] = data
 
     return json.dumps(element_data)
 
 
-# Replace the generate_visualization function in visualizer/utils.py with this improved version
+# Output image formats mapped to their MIME types
+IMAGE_FORMATS = {
+    'png': 'image/png',
+    'png8': 'image/png',  # Palette-quantized PNG
+    'webp': 'image/webp',
+}
 
-def generate_visualization(kit_elements, tags, other_elements=None, tag_size=12, auto_scale=True):
-    """
-    Generate a static image of the elements and tags with clear axes
 
-    Args:
-        kit_elements: List of Element objects from KIT(DS)1 family
-        tags: List of Tag objects with positions
-        other_elements: Optional list of other Element objects
-        tag_size: Size of the tags
-        auto_scale: Whether to automatically scale elements
+def compute_view_layout(all_elements, tags=None):
+    """
+    Compute the padded view limits and figure size for elements and tags
 
     Returns:
-        Tuple of (Base64 encoded image data, Element data JSON)
+        Tuple of ((min_x, max_x, min_y, max_y), (fig_width, fig_height))
     """
-    # Determine plot size
-    all_elements = kit_elements + (other_elements or [])
-
-    if not all_elements:
-        return None, "{}"
-
     # Get original element bounds
     orig_min_x = min(e.min_x for e in all_elements)
     orig_min_y = min(e.min_y for e in all_elements)
@@ -611,103 +868,350 @@ def generate_visualization(kit_elements, tags, other_elements=None, tag_size=12,
         fig_width = 10
         fig_height = 8
 
-    # Create figure and axis with better DPI for clarity
-    fig = Figure(figsize=(fig_width, fig_height), dpi=150)
-    ax = fig.add_subplot(111)
+    return (padded_min_x, padded_max_x, padded_min_y, padded_max_y), (fig_width, fig_height)
+
+
+# Rendered figures are kept per thread, as a matplotlib figure must not be drawn by two threads at once
+FIGURE_TEMPLATE_CACHE_SIZE = 4
+# Figures whose sizes round to the same multiple of this many inches share a template
+FIGURE_SIZE_STEP = 0.5
+
+_figure_templates = threading.local()
+
+
+def aspect_class(aspect_ratio):
+    """Returns 'wide', 'tall' or 'balanced' for the width / height ratio of a view"""
+    if aspect_ratio > 1.5:
+        return 'wide'
+    if aspect_ratio < 0.67:
+        return 'tall'
+    return 'balanced'
+
+
+def _tick_label_chars(low, high):
+    """Longest tick label (formatted with '%.2f') that can appear between two limits"""
+    return max(len(f'{low:.2f}'), len(f'{high:.2f}'))
+
+
+class FigureTemplate:
+    """
+    Styled figure reused for renders with the same size, aspect class and tick label widths
+
+    The subplot margins are computed with tight_layout once, when the template is
+    created. Each render only sets the axis limits and replaces the data artists.
+    """
+
+    def __init__(self, fig_size, dpi, limits):
+        self.figure = Figure(figsize=fig_size, dpi=dpi)
+        self.canvas = FigureCanvas(self.figure)
+        self.ax = ax = self.figure.add_subplot(111)
+
+        # Limits are always set explicitly
+        ax.set_autoscale_on(False)
+
+        # Improve axes labels with larger font
+        ax.set_xlabel('X Coordinate', fontsize=12)
+        ax.set_ylabel('Y Coordinate', fontsize=12)
+
+        # Add title with larger font
+        ax.set_title('Element Visualization', fontsize=14, pad=20)
+
+        # Add grid for better readability
+        ax.grid(True, linestyle='--', alpha=0.5)
+
+        # Add more tick marks for better reference
+        ax.xaxis.set_major_locator(ticker.MaxNLocator(10))
+        ax.yaxis.set_major_locator(ticker.MaxNLocator(10))
+
+        # Add minor grid lines
+        ax.minorticks_on()
+        ax.grid(which='minor', linestyle=':', alpha=0.2)
+
+        # Improve tick label formatting with better precision
+        ax.xaxis.set_major_formatter(ticker.FormatStrFormatter('%.2f'))
+        ax.yaxis.set_major_formatter(ticker.FormatStrFormatter('%.2f'))
+
+        # Make tick labels larger for better readability
+        ax.tick_params(axis='both', which='major', labelsize=10)
 
-    # Set axis limits with a bit more padding
-    ax.set_xlim(padded_min_x, padded_max_x)
-    ax.set_ylim(padded_min_y, padded_max_y)
+        # Use tight layout with more padding, measured once for all renders using this template
+        self.set_limits(limits)
+        self.figure.tight_layout(pad=2.5)
 
-    # Plot elements with improved visibility
+    def set_limits(self, limits):
+        min_x, max_x, min_y, max_y = limits
+        self.ax.set_xlim(min_x, max_x)
+        self.ax.set_ylim(min_y, max_y)
+
+    def clear(self):
+        """Remove the data artists of the last render"""
+        for artist in self.ax.collections[::-1] + self.ax.texts[::-1]:
+            artist.remove()
+
+
+def get_figure_template(limits, fig_size, dpi):
+    """
+    Returns the calling thread's figure template for a view, creating it if needed
+
+    Args:
+        limits: (min_x, max_x, min_y, max_y) of the view
+        fig_size: (width, height) of the figure in inches
+        dpi: Resolution of the figure
+    """
+    min_x, max_x, min_y, max_y = limits
+    size_class = tuple(round(size / FIGURE_SIZE_STEP) for size in fig_size)
+    key = (
+        size_class, aspect_class(fig_size[0] / fig_size[1]), dpi,
+        _tick_label_chars(min_x, max_x), _tick_label_chars(min_y, max_y),
+    )
+
+    templates = getattr(_figure_templates, 'cache', None)
+    if templates is None:
+        templates = _figure_templates.cache = OrderedDict()
+
+    template = templates.get(key)
+    if template is None:
+        template = templates[key] = FigureTemplate(fig_size, dpi, limits)
+        if len(templates) > FIGURE_TEMPLATE_CACHE_SIZE:
+            templates.popitem(last=False)
+    else:
+        templates.move_to_end(key)
+        # Margins are fractions of the figure, so they still fit after a small size change
+        template.figure.set_size_inches(fig_size)
+        template.set_limits(limits)
+    return template
+
+
+def _draw_on_template(kit_elements, tags, other_elements=None, dpi=150):
+    """Set up a figure template with the artists for the elements and tags"""
+    all_elements = kit_elements + (other_elements or [])
+
+    limits, fig_size = compute_view_layout(all_elements, tags)
+    template = get_figure_template(limits, fig_size, dpi)
+    template.clear()
+    ax = template.ax
+
+    # Plot elements as one collection, with a thicker line for better visibility
+    rgba_by_color = {}
     for element in all_elements:
         color = element.get_color()
-        # Use a thicker line for better visibility
-        line_width = 2 if element.is_kit_ds1 else 1.5
-        rect = patches.Rectangle(
-            (element.min_x, element.min_y),
-            element.width,
-            element.height,
-            linewidth=line_width,
-            edgecolor=color,
-            facecolor=color,
-            alpha=0.7
-        )
-        ax.add_patch(rect)
+        if color not in rgba_by_color:
+            rgba_by_color[color] = to_rgba(color, alpha=0.7)
+    element_colors = [rgba_by_color[e.get_color()] for e in all_elements]
+    ax.add_collection(PolyCollection(
+        [_rectangle_vertices(e.min_x, e.min_y, e.width, e.height) for e in all_elements],
+        facecolors=element_colors,
+        edgecolors=element_colors,
+        linewidths=[2 if e.is_labeled else 1.5 for e in all_elements]
+    ), autolim=False)
 
-    # Plot tags with improved style
-    for tag in tags:
-        element_color = tag.element.get_color()
-        tag_rect = patches.Rectangle(
-            (tag.x, tag.y),
-            tag.width,
-            tag.height,
-            linewidth=1.5,
-            edgecolor=element_color,
-            facecolor='white',
-            alpha=0.9
-        )
-        ax.add_patch(tag_rect)
-
-        # Calculate appropriate font size based on tag height
-        font_size = max(tag.height * 0.85, 9)
-
-        ax.text(
-            tag.x + tag.width / 2,
-            tag.y + tag.height / 2,
-            tag.text,
-            horizontalalignment='center',
-            verticalalignment='center',
-            fontsize=font_size,
-            color='black',
-            weight='bold'
-        )
+    if tags:
+        # Plot tags with improved style
+        tag_colors = [tag.element.get_color() for tag in tags]
+        ax.add_collection(PolyCollection(
+            [_rectangle_vertices(tag.x, tag.y, tag.width, tag.height) for tag in tags],
+            facecolors=to_rgba('white', alpha=0.9),
+            edgecolors=[to_rgba(color, alpha=0.9) for color in tag_colors],
+            linewidths=1.5
+        ), autolim=False)
+
+        # Draw connection lines
+        ax.add_collection(LineCollection(
+            [
+                [(tag.line_start_x, tag.line_start_y), (tag.x + tag.width / 2, tag.y + tag.height / 2)]
+                for tag in tags
+            ],
+            colors=tag_colors,
+            linestyles='-',
+            linewidths=1.5,
+            capstyle='projecting',
+            zorder=2
+        ), autolim=False)
 
-        # Draw connection line
-        ax.plot(
-            [tag.line_start_x, tag.x + tag.width / 2],
-            [tag.line_start_y, tag.y + tag.height / 2],
-            color=element_color,
-            linestyle='-',
-            linewidth=1.5
-        )
+        for tag in tags:
+            # Calculate appropriate font size based on tag height
+            font_size = max(tag.height * 0.85, 9)
 
-    # Improve axes labels with larger font
-    ax.set_xlabel('X Coordinate', fontsize=12)
-    ax.set_ylabel('Y Coordinate', fontsize=12)
+            ax.text(
+                tag.x + tag.width / 2,
+                tag.y + tag.height / 2,
+                tag.text,
+                horizontalalignment='center',
+                verticalalignment='center',
+                fontsize=font_size,
+                color='black',
+                weight='bold'
+            )
 
-    # Add title with larger font
-    ax.set_title('Element Visualization', fontsize=14, pad=20)
+    return template
 
-    # Add grid for better readability
-    ax.grid(True, linestyle='--', alpha=0.5)
 
-    # Add more tick marks for better reference
-    ax.xaxis.set_major_locator(plt.MaxNLocator(10))
-    ax.yaxis.set_major_locator(plt.MaxNLocator(10))
+def _rectangle_vertices(x, y, width, height):
+    return ((x, y), (x + width, y), (x + width, y + height), (x, y + height))
+
 
-    # Add minor grid lines
-    ax.minorticks_on()
-    ax.grid(which='minor', linestyle=':', alpha=0.2)
+def build_figure(kit_elements, tags, other_elements=None, dpi=150):
+    """
+    Build the matplotlib figure with the elements and tags
 
-    # Improve tick label formatting with better precision
-    import matplotlib.ticker as ticker
-    ax.xaxis.set_major_formatter(ticker.FormatStrFormatter('%.2f'))
-    ax.yaxis.set_major_formatter(ticker.FormatStrFormatter('%.2f'))
+    Args:
+        kit_elements: List of Element objects to label (KIT(DS)1 family by default)
+        tags: List of Tag objects with positions
+        other_elements: Optional list of other Element objects
+        dpi: Resolution of the figure
 
-    # Make tick labels larger for better readability
-    ax.tick_params(axis='both', which='major', labelsize=10)
+    Returns:
+        A matplotlib Figure with a FigureCanvasAgg. The figure belongs to the calling
+        thread's template cache and is redrawn by the next call with a similar layout.
+    """
+    return _draw_on_template(kit_elements, tags, other_elements, dpi).figure
 
-    # Use tight layout with more padding
-    fig.tight_layout(pad=2.5)
 
-    # Render and return image
-    canvas = FigureCanvas(fig)
+def encode_image(image, image_format='png', compress_level=6, webp_method=4):
+    """
+    Encode an RGB Pillow image
+
+    Args:
+        image: PIL Image in RGB mode
+        image_format: One of IMAGE_FORMATS
+        compress_level: zlib compression level for PNG output (0-9)
+        webp_method: WebP encoder effort (0 = fastest, 6 = smallest)
+
+    Returns:
+        Encoded image bytes
+    """
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f'Unsupported image format: {image_format}')
+
     buffer = io.BytesIO()
-    canvas.print_png(buffer)
-    image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+    if image_format == 'webp':
+        # Lossless WebP keeps flat colors and thin lines crisp
+        image.save(buffer, 'WEBP', lossless=True, method=webp_method)
+    elif image_format == 'png8':
+        # Drawings are mostly flat colors, so a 256-color palette is visually lossless
+        image = image.quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+        image.save(buffer, 'PNG', compress_level=compress_level)
+    else:
+        image.save(buffer, 'PNG', compress_level=compress_level)
+
+    return buffer.getvalue()
+
+
+def encode_canvas(canvas, image_format='png', compress_level=6, webp_method=4):
+    """
+    Encode a drawn Agg canvas into image bytes
+
+    Args:
+        canvas: FigureCanvasAgg on which draw() has been called
+        image_format: One of IMAGE_FORMATS
+        compress_level: zlib compression level for PNG output (0-9)
+        webp_method: WebP encoder effort (0 = fastest, 6 = smallest)
+
+    Returns:
+        Encoded image bytes
+    """
+    # The figure background is opaque, so the alpha channel can be dropped
+    image = Image.fromarray(np.asarray(canvas.buffer_rgba())).convert('RGB')
+    return encode_image(image, image_format, compress_level, webp_method)
+
+
+def render_image(kit_elements, tags, other_elements=None, image_format='png', dpi=150,
+                 compress_level=6, webp_method=4):
+    """Render the elements and tags and return the encoded image bytes"""
+    template = _draw_on_template(kit_elements, tags, other_elements, dpi=dpi)
+    try:
+        template.canvas.draw()
+        return encode_canvas(template.canvas, image_format, compress_level, webp_method)
+    finally:
+        # Do not keep the artists of a large model alive until the template is reused
+        template.clear()
+
+
+def generate_preview(kit_elements, other_elements=None, image_format='png', dpi=50,
+                     compress_level=1, webp_method=0):
+    """
+    Generate a quick low-resolution image of the elements without tags
+
+    All element rectangles are drawn as a single collection and the layout pass
+    is skipped, so the preview is cheap even for large models.
+
+    Returns:
+        Base64 encoded image data
+    """
+    all_elements = kit_elements + (other_elements or [])
+    if not all_elements:
+        return None
+
+    (min_x, max_x, min_y, max_y), fig_size = compute_view_layout(all_elements)
+
+    fig = Figure(figsize=fig_size, dpi=dpi)
+    fig.subplots_adjust(left=0.08, right=0.97, bottom=0.08, top=0.93)
+    ax = fig.add_subplot(111)
+    ax.set_xlim(min_x, max_x)
+    ax.set_ylim(min_y, max_y)
+
+    # Draw all rectangles as a single collection (other families first, so
+    # labeled elements end up on top) instead of one artist per element
+    preview_elements = (other_elements or []) + kit_elements
+    bounds = np.array([e.bounds for e in preview_elements], dtype=float)
+    vertices = bounds[:, [[0, 1], [2, 1], [2, 3], [0, 3]]]
+
+    # Convert each distinct color once instead of once per element
+    rgba_by_color = {}
+    for element in preview_elements:
+        color = element.get_color()
+        if color not in rgba_by_color:
+            rgba_by_color[color] = to_rgba(color, alpha=0.7)
+    colors = np.array([rgba_by_color[e.get_color()] for e in preview_elements])
+
+    ax.add_collection(
+        PolyCollection(vertices, facecolors=colors, edgecolors='face', antialiased=False),
+        autolim=False
+    )
+
+    ax.set_title('Element Visualization (preview)', fontsize=14)
+    ax.grid(True, linestyle='--', alpha=0.5)
+
+    canvas = FigureCanvas(fig)
+    canvas.draw()
+    image_bytes = encode_canvas(canvas, image_format, compress_level, webp_method)
     plt.close(fig)
 
+    return base64.b64encode(image_bytes).decode('utf-8')
+
+
+def generate_visualization(kit_elements, tags, other_elements=None, tag_size=12, auto_scale=True,
+                           image_format='png', dpi=150, compress_level=6, webp_method=4):
+    """
+    Generate a static image of the elements and tags with clear axes
+
+    Renders with pipeline.render, so large models use the raster renderer.
+
+    Args:
+        kit_elements: List of Element objects to label (KIT(DS)1 family by default)
+        tags: List of Tag objects with positions
+        other_elements: Optional list of other Element objects
+        tag_size: Size of the tags
+        auto_scale: Whether to automatically scale elements
+        image_format: Output format, one of IMAGE_FORMATS
+        dpi: Resolution of the image
+        compress_level: zlib compression level for PNG output
+        webp_method: WebP encoder effort
+
+    Returns:
+        Tuple of (Base64 encoded image data, Element data JSON)
+    """
+    # Imported here, as the pipeline module builds on this one
+    from .pipeline import render
+
+    other_elements = other_elements or []
+    if not kit_elements and not other_elements:
+        return None, "{}"
+
+    image_bytes = render(kit_elements, tags, other_elements, image_format, dpi, compress_level, webp_method)
+    image_base64 = base64.b64encode(image_bytes).decode('utf-8')
+
     # Generate element data JSON
     element_data_json = create_element_data_json(kit_elements, other_elements)
 
@@ -1,7 +1,28 @@
+import asyncio
+import functools
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import NON_FIELD_ERRORS
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
+from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
-from .forms import JsonUploadForm
-from .utils import parse_json_data, place_tags_grid_snapping, generate_visualization
+from . import jobs
+from .export import PLACEMENT_FORMATS, export_placements
+from .forms import FAMILY_RULE_FIELDS, JsonUploadForm, VisualizationOptionsForm
+from .memory import AdmissionError, MemoryBudget, MemoryBudgetBusy, estimate_inflated_size, plan_admission
+from .pipeline import (
+    PROFILE_FILE, VisualizationError, run_preview, run_preview_job, run_visualization, run_visualization_job
+)
+from .utils import IMAGE_FORMATS
+
+# Lazily created semaphore used by the async view
+_render_semaphore = None
+# Lazily created memory budget shared by all renders started from this process
+_memory_budget = None
 
 
 def index(request):
@@ -10,72 +31,519 @@ def index(request):
     return render(request, 'visualizer/index.html', {'form': form})
 
 
-@csrf_exempt
-def visualize(request):
-    """Process the uploaded JSON file and visualize elements"""
-    if request.method == 'POST':
+def _accept_quality(accept, media_type):
+    """Returns the q-value an Accept header gives a media type, taken from its most specific matching range"""
+    main_type = media_type.split('/')[0]
+    best_specificity, quality = -1, 0.0
+    for media_range in accept.split(','):
+        range_type, *params = media_range.split(';')
+        range_type = range_type.strip().lower()
+        if range_type == media_type:
+            specificity = 2
+        elif range_type == f'{main_type}/*':
+            specificity = 1
+        elif range_type == '*/*':
+            specificity = 0
+        else:
+            continue
+
+        range_quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    range_quality = float(value)
+                except ValueError:
+                    range_quality = 0.0
+        if specificity > best_specificity:
+            best_specificity, quality = specificity, range_quality
+    return quality
+
+
+def _negotiate_image_format(request, requested_format):
+    """
+    Returns the output image format from the request parameter or Accept header
+
+    WebP is used when the Accept header prefers it to VISUALIZER_IMAGE_FORMAT.
+    """
+    if requested_format:
+        return requested_format
+    default_format = settings.VISUALIZER_IMAGE_FORMAT
+    accept = request.headers.get('Accept')
+    if accept and _accept_quality(accept, 'image/webp') > _accept_quality(accept, IMAGE_FORMATS[default_format]):
+        return 'webp'
+    return default_format
+
+
+def _read_upload_request(request):
+    """
+    Validate the upload part of a visualize request
+
+    Returns:
+        Tuple of (form, upload, pipeline kwargs), or (form, None, None) if the form is invalid.
+        For raw JSON bodies the form is the VisualizationOptionsForm of the query parameters.
+    """
+    if request.content_type == 'application/json':
+        # Raw JSON request body, optionally sent with Content-Encoding: gzip.
+        # Visualization options are passed as query parameters, family rules
+        # may be repeated (?label_families=KIT*&label_families=Door*).
+        query = request.GET.copy()
+        for field in FAMILY_RULE_FIELDS:
+            query[field] = '\n'.join(request.GET.getlist(field))
+        options_form = VisualizationOptionsForm(query)
+        form = JsonUploadForm()
+
+        if not options_form.is_valid():
+            return options_form, None, None
+
+        cleaned_data = options_form.cleaned_data
+        upload = request
+        options = {
+            'upload_name': None,
+            'content_encoding': request.headers.get('Content-Encoding'),
+        }
+    else:
         form = JsonUploadForm(request.POST, request.FILES)
 
-        if form.is_valid():
-            # Get form settings
-            show_other_families = form.cleaned_data.get('show_other_families', False)
+        if not form.is_valid():
+            return form, None, None
 
-            # Use default values for visualization settings
-            tag_size = 12
-            auto_scale = True  # Always enable auto-scaling for better visualization
+        cleaned_data = form.cleaned_data
+        upload = cleaned_data['json_file']
+        options = {
+            'upload_name': upload.name,
+            'content_encoding': None,
+        }
 
-            # Get and save the file temporarily
-            json_file = request.FILES['json_file']
-            file_content = json_file.read().decode('utf-8')
+    # Use default values for visualization settings
+    options.update({
+        'families': cleaned_data['families'],
+        'max_inflated_size': settings.VISUALIZER_MAX_INFLATED_SIZE,
+        'tag_size': 12,
+        'auto_scale': True,  # Always enable auto-scaling for better visualization
+        'image_format': _negotiate_image_format(request, cleaned_data.get('image_format')),
+        'dpi': cleaned_data.get('dpi') or settings.VISUALIZER_DPI,
+        'compress_level': settings.VISUALIZER_PNG_COMPRESS_LEVEL,
+        'webp_method': settings.VISUALIZER_WEBP_METHOD,
+        'raster_threshold': settings.VISUALIZER_RASTER_THRESHOLD,
+        'lod_pixels': settings.VISUALIZER_LOD_PIXELS,
+        'max_labels': None,
+        'track_memory': settings.VISUALIZER_TRACK_MEMORY,
+        'profile': _wants_profile(request),
+    })
+    return form, upload, options
 
-            # Parse the JSON data
-            elements = parse_json_data(file_content)
 
-            if not elements:
-                return render(request, 'visualizer/index.html', {
-                    'form': form,
-                    'error': 'No valid elements found in the JSON file.'
-                })
+def _form_errors(form):
+    """Returns the validation errors of a form as one message"""
+    messages = []
+    for name, errors in form.errors.items():
+        prefix = '' if name == NON_FIELD_ERRORS else f'{name}: '
+        messages.append(prefix + ' '.join(errors))
+    return ' '.join(messages)
 
-            # Separate KIT(DS)1 elements from others
-            kit_elements = [e for e in elements if e.is_kit_ds1]
-            other_elements = [e for e in elements if not e.is_kit_ds1] if show_other_families else []
 
-            if not kit_elements:
-                return render(request, 'visualizer/index.html', {
-                    'form': form,
-                    'error': 'No KIT(DS)1 family elements found in the JSON file.'
-                })
+def _invalid_upload_context(form):
+    """Template context for an upload request whose form is invalid"""
+    if isinstance(form, JsonUploadForm):
+        # The upload form shows its own errors
+        return {'form': form, 'error': 'Please submit a valid JSON file.'}
+    # Query parameters of a raw JSON body, which are not on the upload form
+    return {'form': JsonUploadForm(), 'error': f'Invalid options: {_form_errors(form)}'}
 
-            # Generate tags with optimized positions
-            tags = place_tags_grid_snapping(kit_elements, other_elements, tag_size)
 
-            # Generate visualization
-            image_data, element_data_json = generate_visualization(
-                kit_elements, tags, other_elements, tag_size, auto_scale
-            )
+def _wants_profile(request):
+    """Whether a staff user asked for the pipeline to be profiled with ?profile=1"""
+    return request.GET.get('profile') == '1' and request.user.is_staff
 
-            # Statistics for the template
-            stats = {
-                'total_elements': len(elements),
-                'kit_elements': len(kit_elements),
-                'other_elements': len(other_elements),
-                'tags_placed': len(tags)
-            }
-
-            return render(request, 'visualizer/result.html', {
-                'image_data': image_data,
-                'element_data_json': element_data_json,
-                'stats': stats,
-                'form': form
-            })
 
+def _use_profile_path(options):
+    """
+    Replace the profile flag in options by a profile path in a new result directory
+
+    Returns:
+        The job id of the result directory, or None if the request is not profiled
+    """
+    if not options.pop('profile'):
+        return None
+    job_id, result_dir = jobs.create_result_dir()
+    options['profile_path'] = os.path.join(result_dir, PROFILE_FILE)
+    return job_id
+
+
+def _profile_urls(job_id, profile_files):
+    """Returns the media URL of each profile file of a job"""
+    return {kind: jobs.get_result_url(job_id, name) for kind, name in profile_files.items()}
+
+
+def _get_memory_budget():
+    """Returns the memory budget shared by concurrent renders"""
+    global _memory_budget
+    if _memory_budget is None:
+        _memory_budget = MemoryBudget(settings.VISUALIZER_MEMORY_BUDGET)
+    return _memory_budget
+
+
+def _admit_upload(request, upload, options):
+    """
+    Reserve memory for rendering an upload, lowering the DPI or the number of
+    labels in options when the full render would not fit into the budget
+
+    Returns:
+        Tuple of (reserved bytes, notice for the result page or None)
+
+    Raises:
+        AdmissionError: If the upload is too large to render at all
+        MemoryBudgetBusy: If the memory did not become available in time
+    """
+    budget = _get_memory_budget()
+    max_inflated_size = options['max_inflated_size']
+    upload_size = getattr(upload, 'size', None)
+    if upload_size is None and request.META.get('CONTENT_LENGTH'):
+        upload_size = int(request.META['CONTENT_LENGTH'])
+
+    if upload_size is None:
+        # A body without Content-Length (e.g. chunked) can grow up to the inflate limit,
+        # which the upload stream enforces, so plan for that much
+        if max_inflated_size is None:
+            raise AdmissionError('Please send the size of the upload in the Content-Length header.')
+        inflated_size = max_inflated_size
+    else:
+        inflated_size = estimate_inflated_size(
+            upload, upload_size, options['upload_name'], options['content_encoding']
+        )
+        if max_inflated_size is not None:
+            inflated_size = min(inflated_size, max_inflated_size)
+
+    try:
+        estimate, dpi, max_labels = plan_admission(
+            inflated_size, options['dpi'], budget.total_bytes,
+            min_dpi=settings.VISUALIZER_MIN_DPI, min_labels=settings.VISUALIZER_MIN_LABELS
+        )
+    except AdmissionError:
+        if upload_size is not None:
+            raise
+        raise AdmissionError(
+            f'The size of this upload is unknown, and an upload of up to {max_inflated_size / 2 ** 20:,.0f} MB '
+            'cannot be rendered within the server memory limit. Please send it with a Content-Length header.'
+        )
+
+    notice = None
+    if dpi != options['dpi'] or max_labels is not None:
+        notice = f'This file is large, so it was rendered at {dpi} DPI'
+        if max_labels is not None:
+            notice += f' with tags for the first {max_labels:,} elements only'
+        notice += ' to stay within the server memory limit.'
+
+    options.update({'dpi': dpi, 'max_labels': max_labels})
+    reserved = budget.reserve(estimate, timeout=settings.VISUALIZER_MEMORY_QUEUE_TIMEOUT)
+    return reserved, notice
+
+
+def _busy_response(request, as_json=False):
+    """503 response asking the client to retry later"""
+    error = 'The server is busy rendering other files. Please try again shortly.'
+    if as_json:
+        response = JsonResponse({'error': error}, status=503)
+    else:
+        response = render(request, 'visualizer/index.html', {'form': JsonUploadForm(), 'error': error}, status=503)
+    response['Retry-After'] = str(settings.VISUALIZER_RETRY_AFTER)
+    return response
+
+
+def _start_progressive_render(upload, options, executor=None):
+    """
+    Render a quick preview and start the full-resolution render in the background
+
+    Args:
+        executor: Process pool to parse and render the preview in, in this thread if None
+
+    Returns:
+        Tuple of (preview context for the result template, future of the full render)
+    """
+    job_id, result_dir = jobs.create_result_dir()
+    render_options = dict(options)
+    upload_name = jobs.save_upload(
+        result_dir, upload, render_options.pop('upload_name'), render_options.pop('content_encoding')
+    )
+
+    preview_options = {
+        'upload_name': upload_name,
+        'families': options['families'],
+        'max_inflated_size': options['max_inflated_size'],
+        'image_format': options['image_format'],
+        'dpi': settings.VISUALIZER_PREVIEW_DPI,
+    }
+    upload_path = os.path.join(result_dir, upload_name)
+    try:
+        if executor is not None:
+            context = executor.submit(functools.partial(run_preview_job, upload_path, **preview_options)).result()
         else:
+            with open(upload_path, 'rb') as stored_upload:
+                context = run_preview(stored_upload, **preview_options)
+        future = jobs.submit_full_render(result_dir, upload_name, **render_options)
+    except (VisualizationError, BrokenProcessPool):
+        jobs.discard_result(job_id)
+        raise
+
+    context['render_status_url'] = reverse('visualizer:render_status', args=[job_id])
+    # Profile files are linked once the full render has finished
+    context['profile_pending'] = options['profile']
+    return context, future
+
+
+def render_status(request, job_id):
+    """Report whether the full-resolution render of a job is ready"""
+    job_id = str(job_id)
+    if not os.path.isdir(jobs.get_result_dir(job_id)):
+        return JsonResponse({'status': 'unknown'}, status=404)
+
+    status = jobs.read_status(job_id) or {'status': 'pending'}
+    if status.get('image'):
+        status['image_url'] = jobs.get_result_url(job_id, status['image'])
+    if status.get('element_data'):
+        status['element_data_url'] = jobs.get_result_url(job_id, status['element_data'])
+    if status.get('profile'):
+        status['profile_urls'] = _profile_urls(job_id, status['profile'])
+    return JsonResponse(status)
+
+
+@csrf_exempt
+def visualize(request):
+    """Process the uploaded JSON file and visualize elements"""
+    if request.method == 'POST':
+        form, upload, options = _read_upload_request(request)
+
+        if upload is None:
             # Form is not valid
+            return render(request, 'visualizer/index.html', _invalid_upload_context(form))
+
+        try:
+            reserved, notice = _admit_upload(request, upload, options)
+        except AdmissionError as e:
+            return render(request, 'visualizer/index.html', {
+                'form': form,
+                'error': str(e)
+            })
+        except MemoryBudgetBusy:
+            return _busy_response(request)
+
+        budget = _get_memory_budget()
+        release_on_exit = True
+        try:
+            if settings.VISUALIZER_PROGRESSIVE_RENDER:
+                context, future = _start_progressive_render(upload, options)
+                # The background render keeps its memory reservation until it finishes
+                future.add_done_callback(lambda _: budget.release(reserved))
+                release_on_exit = False
+            else:
+                profile_job_id = _use_profile_path(options)
+                context = run_visualization(upload, **options)
+                context['profile_urls'] = _profile_urls(profile_job_id, context.pop('profile_files'))
+        except VisualizationError as e:
             return render(request, 'visualizer/index.html', {
                 'form': form,
-                'error': 'Please submit a valid JSON file.'
+                'error': str(e)
             })
+        finally:
+            if release_on_exit:
+                budget.release(reserved)
+
+        context['form'] = form
+        context['notice'] = notice
+        return render(request, 'visualizer/result.html', context)
 
     # If not POST, redirect to index
-    return redirect('visualizer:index')
\ No newline at end of file
+    return redirect('visualizer:index')
+
+
+def _negotiate_placement_format(request):
+    """
+    Returns the placement export format from the format parameter or Accept header
+
+    CSV is used when the Accept header prefers it to JSON lines.
+    """
+    requested_format = request.GET.get('format')
+    if requested_format:
+        return requested_format
+    accept = request.headers.get('Accept')
+    if accept and _accept_quality(accept, 'text/csv') > _accept_quality(accept, 'application/x-ndjson'):
+        return 'csv'
+    return 'jsonl'
+
+
+class _ReservedLines:
+    """
+    Iterator over the lines of a streamed response holding a memory reservation
+
+    StreamingHttpResponse calls close() when the response is closed, also when the
+    client disconnects before the first line, which releases the reservation once.
+    """
+
+    def __init__(self, lines, budget, reserved):
+        self._lines = lines
+        self._budget = budget
+        self._reserved = reserved
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._lines)
+
+    def close(self):
+        if self._reserved is not None:
+            self._budget.release(self._reserved)
+            self._reserved = None
+
+
+@csrf_exempt
+def placements(request):
+    """Stream the tag placement of an upload as JSON lines or CSV, without rendering an image"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST a JSON file to export its tag placement.'}, status=405)
+
+    output_format = _negotiate_placement_format(request)
+    if output_format not in PLACEMENT_FORMATS:
+        return JsonResponse({
+            'error': f'Unknown format "{output_format}", expected one of {", ".join(sorted(PLACEMENT_FORMATS))}.'
+        }, status=400)
+
+    form, upload, options = _read_upload_request(request)
+    if upload is None:
+        return JsonResponse({'error': _form_errors(form) or 'Please submit a valid JSON file.'}, status=400)
+
+    try:
+        reserved, _ = _admit_upload(request, upload, options)
+    except AdmissionError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except MemoryBudgetBusy:
+        return _busy_response(request, as_json=True)
+
+    budget = _get_memory_budget()
+    release_on_exit = True
+    try:
+        lines = export_placements(
+            upload, output_format,
+            upload_name=options['upload_name'],
+            content_encoding=options['content_encoding'],
+            max_inflated_size=options['max_inflated_size'],
+            tag_size=options['tag_size'],
+            max_labels=options['max_labels'],
+            families=options['families'],
+        )
+        # The placed tags stay in memory until the response has been sent
+        response = StreamingHttpResponse(
+            _ReservedLines(lines, budget, reserved), content_type=PLACEMENT_FORMATS[output_format]
+        )
+        release_on_exit = False
+    except VisualizationError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    finally:
+        if release_on_exit:
+            budget.release(reserved)
+
+    response['Content-Disposition'] = f'attachment; filename="placements.{output_format}"'
+    if options['max_labels'] is not None:
+        response['X-Max-Labels'] = str(options['max_labels'])
+    return response
+
+
+def _get_render_semaphore():
+    """Returns the semaphore limiting concurrently processed uploads"""
+    global _render_semaphore
+    if _render_semaphore is None:
+        _render_semaphore = asyncio.Semaphore(settings.VISUALIZER_MAX_CONCURRENT_RENDERS)
+    return _render_semaphore
+
+
+def _release_from_callback(loop, semaphore, future):
+    """Release the render semaphore from an executor callback thread"""
+    try:
+        loop.call_soon_threadsafe(semaphore.release)
+    except RuntimeError:
+        # The event loop has already been closed
+        pass
+
+
+def _upload_source(upload):
+    """Returns a path or bytes for the upload that can be sent to a worker process"""
+    if hasattr(upload, 'temporary_file_path'):
+        return upload.temporary_file_path()
+    return upload.read()
+
+
+@csrf_exempt
+async def visualize_async(request):
+    """Async version of visualize for ASGI deployments"""
+    if request.method != 'POST':
+        return redirect('visualizer:index')
+
+    # Apply backpressure instead of queueing an unbounded number of renders
+    semaphore = _get_render_semaphore()
+    try:
+        await asyncio.wait_for(semaphore.acquire(), timeout=settings.VISUALIZER_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        return await sync_to_async(_busy_response)(request)
+
+    budget = _get_memory_budget()
+    reserved = 0
+    release_on_exit = True
+    try:
+        form, upload, options = await sync_to_async(_read_upload_request, thread_sensitive=False)(request)
+
+        if upload is None:
+            return await sync_to_async(render)(request, 'visualizer/index.html', _invalid_upload_context(form))
+
+        try:
+            reserved, notice = await sync_to_async(_admit_upload, thread_sensitive=False)(
+                request, upload, options
+            )
+        except AdmissionError as e:
+            return await sync_to_async(render)(request, 'visualizer/index.html', {
+                'form': form,
+                'error': str(e)
+            })
+        except MemoryBudgetBusy:
+            return await sync_to_async(_busy_response)(request)
+
+        loop = asyncio.get_running_loop()
+        executor = jobs.get_render_executor()
+        try:
+            if settings.VISUALIZER_PROGRESSIVE_RENDER:
+                # The preview is parsed and rendered in a worker process right away, the full
+                # render keeps its slot and memory reservation until the background job finishes
+                context, future = await sync_to_async(_start_progressive_render, thread_sensitive=False)(
+                    upload, options, executor
+                )
+                future.add_done_callback(functools.partial(_release_from_callback, loop, semaphore))
+                future.add_done_callback(lambda _: budget.release(reserved))
+                release_on_exit = False
+            else:
+                source = await sync_to_async(_upload_source, thread_sensitive=False)(upload)
+                profile_job_id = await sync_to_async(_use_profile_path, thread_sensitive=False)(options)
+
+                # Parse, placement and render run in a worker process
+                context = await loop.run_in_executor(
+                    executor, functools.partial(run_visualization_job, source, **options)
+                )
+                context['profile_urls'] = _profile_urls(profile_job_id, context.pop('profile_files'))
+        except VisualizationError as e:
+            return await sync_to_async(render)(request, 'visualizer/index.html', {
+                'form': form,
+                'error': str(e)
+            })
+        except BrokenProcessPool:
+            jobs.discard_render_executor(executor)
+            return await sync_to_async(render)(request, 'visualizer/index.html', {
+                'form': form,
+                'error': jobs.WORKER_FAILED_ERROR
+            })
+    finally:
+        if release_on_exit:
+            semaphore.release()
+            budget.release(reserved)
+
+    context['form'] = form
+    context['notice'] = notice
+    return await sync_to_async(render)(request, 'visualizer/result.html', context)